@@ -1,3 +1,5 @@
+from datetime import datetime
+from typing import Optional
 from fastapi import APIRouter, Depends
 from stufio.crud.clickhouse_base import AsyncClient
 from stufio.schemas.base_schema import PaginatedResponse
@@ -18,12 +20,17 @@ router = APIRouter()
 async def read_own_activities(
     skip: int = 0,
     limit: int = 100,
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None,
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> PaginatedResponse[UserActivityResponse]:
     """
     Retrieve current user's activity history.
+
+    Pass the timestamp and event_id of the last item as before/before_id
+    to fetch the next page without an offset scan.
     """
     activities, total = await crud_activity.get_user_activities(
-        user_id=str(current_user.id), skip=skip, limit=limit
+        user_id=str(current_user.id), skip=skip, limit=limit, before=before, before_id=before_id
     )
     return PaginatedResponse(items=activities, total=total, skip=skip, limit=limit)
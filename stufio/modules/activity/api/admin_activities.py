@@ -1,4 +1,5 @@
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 from clickhouse_connect.driver.asyncclient import AsyncClient
 from fastapi import APIRouter, Depends, Query
 from stufio.schemas.base_schema import PaginatedResponse
@@ -19,14 +20,19 @@ async def read_user_activities(
     user_id: str,
     skip: int = 0,
     limit: int = 100,
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None,
     current_user: models.User = Depends(deps.get_current_active_superuser),
 ) -> PaginatedResponse[UserActivityResponse]:
     """
     Retrieve activities for a specific user.
     Only for superusers.
+
+    Pass the timestamp and event_id of the last item as before/before_id
+    to fetch the next page without an offset scan.
     """
     activities, total = await crud_activity.get_user_activities(
-        user_id=user_id, skip=skip, limit=limit
+        user_id=user_id, skip=skip, limit=limit, before=before, before_id=before_id
     )
     return PaginatedResponse(items=activities, total=total, skip=skip, limit=limit)
 
@@ -1,12 +1,14 @@
 from typing import Dict, Any, List
 from clickhouse_connect.driver.asyncclient import AsyncClient
 from fastapi import APIRouter, Depends, Query
+from fastapi.responses import ORJSONResponse
 
 from stufio.api import deps
 from ..schemas import PathStatistics, ErrorReport
 from ..crud.crud_analytics import crud_analytics
 
-router = APIRouter()
+# Reports are large lists of rows, encode them with orjson
+router = APIRouter(default_response_class=ORJSONResponse)
 
 
 @router.get("/activities/path-report")
@@ -13,6 +13,7 @@ from ..schemas import (
     ViolationReport,
 )
 from ..crud.crud_rate_limit import crud_rate_limit
+from ..services.rate_limit import rate_limit_service
 from stufio.core.config import get_settings
 
 settings = get_settings()
@@ -55,6 +56,7 @@ async def admin_create_rate_limit_config(
         description=config.description,
         active=config.active
     )
+    await rate_limit_service.invalidate_config_cache()
 
     return created_config
 
@@ -82,6 +84,7 @@ async def admin_update_rate_limit_config(
     if not updated_config:
         raise HTTPException(status_code=404, detail="Rate limit configuration not found")
 
+    await rate_limit_service.invalidate_config_cache()
     return updated_config
 
 
@@ -98,6 +101,7 @@ async def admin_delete_rate_limit_config(
     if not success:
         raise HTTPException(status_code=404, detail="Rate limit configuration not found")
 
+    await rate_limit_service.invalidate_config_cache()
     return Msg(msg="Rate limit configuration deleted")
 
 
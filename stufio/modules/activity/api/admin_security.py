@@ -1,8 +1,8 @@
-from ast import Dict
 from typing import Any, List
 from clickhouse_connect.driver.asyncclient import AsyncClient
 from fastapi import APIRouter, Depends, HTTPException, Body
 from fastapi.params import Query
+from fastapi.responses import ORJSONResponse
 from motor.core import AgnosticDatabase
 
 from stufio import models
@@ -45,6 +45,7 @@ async def admin_restrict_user(
 @router.get(
     "/security/suspicious-activities",
     response_model=List[SuspiciousActivityResponse],
+    response_class=ORJSONResponse,
 )
 async def get_all_suspicious_activities(
     skip: int = 0,
@@ -57,11 +58,13 @@ async def get_all_suspicious_activities(
     activities = await user_activity.get_all_suspicious_activities(
         skip=skip, limit=limit
     )
-    return [SuspiciousActivityResponse(**activity) for activity in activities]
+    # Validated once by the response model
+    return activities
 
 
 @router.get(
     "/security/analytics",
+    response_class=ORJSONResponse,
 )
 async def get_security_analytics(
     days: int = Query(30, description="Days of data to analyze"),
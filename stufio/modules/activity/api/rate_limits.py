@@ -6,6 +6,7 @@ from stufio import models
 from stufio.api import deps
 from ..schemas import RateLimitStatus
 from ..crud import crud_rate_limit
+from ..services.rate_limit import rate_limit_service
 from stufio.core.config import get_settings
 
 settings = get_settings()
@@ -14,7 +15,6 @@ router = APIRouter()
 
 @router.get("/user/rate-limits", response_model=Dict[str, RateLimitStatus])
 async def get_rate_limit_status(
-    clickhouse_db = Depends(deps.get_clickhouse),
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> List[Dict[str, RateLimitStatus]]:
     """
@@ -23,26 +23,27 @@ async def get_rate_limit_status(
     """
     user_id = str(current_user.id)
 
-    # Get common endpoints status
-    status = {}
-
     # Overall API limit
-    status["api"] = await crud_rate_limit.get_user_limit_status(
-        user_id=user_id,
-        path="*",
-        max_requests=settings.activity_RATE_LIMIT_USER_MAX_REQUESTS,
-        window_seconds=settings.activity_RATE_LIMIT_USER_WINDOW_SECONDS,
+    names = ["api"]
+    limits = [(
+        "*",
+        settings.activity_RATE_LIMIT_USER_MAX_REQUESTS,
+        settings.activity_RATE_LIMIT_USER_WINDOW_SECONDS,
+    )]
+
+    # Specific endpoint limits, shared with the middleware's config cache
+    configs = await rate_limit_service.get_cached_configs(
+        db_fetch_func=crud_rate_limit.fetch_rate_limit_configs,
+        active_only=True,
+        limit=1000,
+    )
+    for config in sorted(configs, key=lambda c: c["endpoint"]):
+        names.append(config["endpoint"])
+        limits.append((config["endpoint"], config["max_requests"], config["window_seconds"]))
+
+    # All statuses come from a single ClickHouse aggregation
+    statuses = await crud_rate_limit.get_user_limit_status_bulk(
+        user_id=user_id, limits=limits
     )
 
-    # Check specific endpoint limits from MongoDB
-    configs = await crud_rate_limit.get_all_rate_limit_configs(active_only=True)
-    for config in configs:
-        endpoint = config.endpoint
-        status[endpoint] = await crud_rate_limit.get_user_limit_status(
-            user_id=user_id,
-            path=endpoint,
-            max_requests=config.max_requests,
-            window_seconds=config.window_seconds
-        )
-
-    return status
+    return dict(zip(names, statuses))
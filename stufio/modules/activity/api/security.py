@@ -28,7 +28,7 @@ async def get_security_profile(
         # Create a default profile if none exists
         security_profile = UserSecurityProfile(current_user.id)
 
-    return UserSecurityProfileResponse(**security_profile.model_dump())
+    return security_profile
 
 
 @router.get(
@@ -44,10 +44,8 @@ async def get_trusted_devices(
     if not security_profile:
         return []
 
-    return [
-        TrustedDeviceResponse(**device.model_dump())
-        for device in security_profile.known_fingerprints
-    ]
+    # The response model validates the embedded fingerprints directly
+    return security_profile.known_fingerprints
 
 
 @router.post("/user/security/trusted-devices", response_model=TrustedDeviceResponse)
@@ -96,4 +94,5 @@ async def get_suspicious_activities(
     activities = await user_activity.get_suspicious_activities(
         user_id=str(current_user.id), skip=skip, limit=limit
     )
-    return [SuspiciousActivityResponse(**activity) for activity in activities]
+    # Validated once by the response model
+    return activities
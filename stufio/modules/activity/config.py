@@ -15,14 +15,37 @@ class ActivitySettings(ModuleSettings):
     RATE_LIMIT_USER_MAX_REQUESTS: int = 300
     RATE_LIMIT_USER_WINDOW_SECONDS: int = 60
     SECURITY_MAX_UNIQUE_IPS_PER_DAY: int = 5
+    SECURITY_REDIS_PREFIX: str = "activity:security:"
+    SECURITY_PROFILE_CACHE_TTL: int = 300 # 5 minutes
+    SECURITY_PROFILE_CACHE_SIZE: int = 100000
+    SECURITY_PROFILE_FLUSH_INTERVAL: float = 10 # seconds between fingerprint counter writes
 
     # Redis settings for rate limiting
     RATE_LIMIT_REDIS_PREFIX: str = "ratelimit:"
     RATE_LIMIT_CONFIG_TTL: int = 120 # 2 minutes
-    RATE_LIMIT_DECISION_TTL: int = 30 # 30 seconds
     IP_BLACKLIST_TTL: int = 86400  # 1 day
     RATE_LIMIT_ENDPOINTS: list = []
 
+    # Background ClickHouse writes for rate limiting
+    RATE_LIMIT_FLUSH_INTERVAL: float = 0.5 # seconds
+    RATE_LIMIT_FLUSH_BATCH_SIZE: int = 500
+
+    # API request events for these path prefixes are not recorded
+    ACTIVITY_IGNORED_PATH_PREFIXES: list = ["/health", "/metrics", "/favicon.ico", "/static/"]
+
+    # Background ClickHouse writes for user activity
+    ACTIVITY_FLUSH_INTERVAL: float = 0.5 # seconds
+    ACTIVITY_FLUSH_BATCH_SIZE: int = 1000
+    ACTIVITY_MAX_PENDING: int = 50000
+
+    # Activity listings stop counting matching rows past this many
+    ACTIVITY_COUNT_LIMIT: int = 10000
+
+    # Redis cache for admin analytics reports
+    ANALYTICS_CACHE_PREFIX: str = "activity:analytics:"
+    ANALYTICS_PATH_REPORT_CACHE_TTL: int = 60 # 1 minute
+    ANALYTICS_ERROR_REPORT_CACHE_TTL: int = 300 # 5 minutes
+
 
 # Register these settings with the core
 settings.register_module_settings("activity", ActivitySettings)
@@ -4,9 +4,11 @@ Consumer for API request events from the events module.
 This consumer processes API request events from Kafka and stores them 
 as user activity in the activity module's database
 """
-from aiokafka import metrics
+import asyncio
+from collections import OrderedDict
+from time import monotonic
 from faststream.kafka.fastapi import Logger
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
 from stufio.modules.events import (
     HandlerResponse,
@@ -15,7 +17,74 @@ from stufio.modules.events import (
     APIRequestEvent,
     APIRequestPayload,
 )
+from stufio.core.config import get_settings
 from ..crud import crud_activity
+from ..crud.crud_activity import ANON_USER_PREFIX
+
+settings = get_settings()
+
+# Recent negative suspicious checks: (user_id, ip, user agent, path, method,
+# status class) -> expires_at. Only "not suspicious" results are cached, so every
+# suspicious event is still checked and logged.
+CLEAN_CHECK_CACHE_SIZE = 100_000
+CLEAN_CHECK_CACHE_TTL = 5  # seconds
+_clean_checks: "OrderedDict[Tuple, float]" = OrderedDict()
+
+# ACTIVITY_IGNORED_PATH_PREFIXES compiled into (exact paths, "prefix/" tuple),
+# rebuilt only when the setting is replaced
+_ignored_paths_source: Optional[list] = None
+_ignored_paths: Tuple[frozenset, Tuple[str, ...]] = (frozenset(), ())
+
+
+def _is_ignored_path(path: str) -> bool:
+    """Match a path against the ignored prefixes on path segment boundaries"""
+    global _ignored_paths_source, _ignored_paths
+
+    prefixes = settings.activity_ACTIVITY_IGNORED_PATH_PREFIXES
+    if prefixes is not _ignored_paths_source:
+        # "/health" matches "/health" and "/health/live" but not "/healthcare"
+        roots = [prefix.rstrip("/") for prefix in prefixes or []]
+        _ignored_paths = (frozenset(roots), tuple(root + "/" for root in roots))
+        _ignored_paths_source = prefixes
+
+    exact, nested = _ignored_paths
+    return path in exact or path.startswith(nested)
+
+
+async def _check_suspicious_activity(
+    *,
+    user_id: Optional[str],
+    client_ip: str,
+    user_agent: str,
+    path: str,
+    method: str,
+    status_code: int,
+) -> bool:
+    """Run the suspicious activity check unless the same request was found clean moments ago"""
+    # The check compares the user agent with known devices, so it is part of the key
+    key = (user_id, client_ip, user_agent, path, method, status_code // 100)
+    now = monotonic()
+    expires_at = _clean_checks.get(key)
+    if expires_at is not None:
+        if expires_at > now:
+            return False
+        del _clean_checks[key]
+
+    is_suspicious = await crud_activity.check_suspicious_activity(
+        user_id=user_id,
+        client_ip=client_ip,
+        user_agent=user_agent,
+        path=path,
+        method=method,
+        status_code=status_code,
+    )
+    if not is_suspicious:
+        _clean_checks[key] = now + CLEAN_CHECK_CACHE_TTL
+        if len(_clean_checks) > CLEAN_CHECK_CACHE_SIZE:
+            _clean_checks.popitem(last=False)
+
+    return is_suspicious
+
 
 @stufio_event_subscriber(APIRequestEvent)  # Changed decorator
 async def handle_api_request_event(
@@ -35,34 +104,53 @@ async def handle_api_request_event(
         payload = event.payload
         
         # Extract user ID, handling anonymous users
-        user_id: Optional[str] = None
-        if payload.user_id and not payload.user_id.startswith("anon-"):
-            user_id = payload.user_id
-
-        # Record the activity in the database
-        await crud_activity.create_activity(
-            user_id=user_id,
-            path=payload.path,
-            method=payload.method,
-            client_ip=payload.remote_ip or "unknown",
-            user_agent=payload.user_agent or "",
-            status_code=payload.status_code,
-            process_time=payload.duration_ms / 1000  # Convert ms to seconds
-        )
+        user_id: Optional[str] = payload.user_id
+        if not user_id or user_id.startswith(ANON_USER_PREFIX):
+            user_id = None
 
-        # Check for suspicious activity based on the request
-        is_suspicious = await crud_activity.check_suspicious_activity(
-            user_id=user_id,
-            client_ip=payload.remote_ip or "unknown",
-            user_agent=payload.user_agent or "",
-            path=payload.path,
-            method=payload.method,
-            status_code=payload.status_code,
+        path = payload.path
+
+        # Health checks and static assets are not user activity
+        if _is_ignored_path(path):
+            return HandlerResponse(metrics={"success": True, "skipped": True})
+
+        client_ip = payload.remote_ip or "unknown"
+        user_agent = payload.user_agent or ""
+        method = payload.method
+        status_code = payload.status_code
+
+        # Record the activity while checking it for suspicious behavior; the
+        # check only reads prior history, so it does not need the new row
+        _, is_suspicious = await asyncio.gather(
+            crud_activity.create_activity(
+                user_id=user_id,
+                path=path,
+                method=method,
+                client_ip=client_ip,
+                user_agent=user_agent,
+                status_code=status_code,
+                process_time=payload.duration_ms * 0.001,  # Convert ms to seconds
+                update_profile=False,
+            ),
+            _check_suspicious_activity(
+                user_id=user_id,
+                client_ip=client_ip,
+                user_agent=user_agent,
+                path=path,
+                method=method,
+                status_code=status_code,
+            ),
         )
 
+        # Remember the device only after it was checked against known ones
+        if user_id:
+            await crud_activity.update_user_security_profile(user_id, client_ip, user_agent)
+
         if is_suspicious:
             logger.warning(
-                f"Suspicious activity detected for user {user_id or 'anonymous'} from {payload.remote_ip}"
+                "Suspicious activity detected for user %s from %s",
+                user_id or "anonymous",
+                client_ip,
             )
             
         # Return custom metrics that will be saved in event_metrics
@@ -75,5 +163,5 @@ async def handle_api_request_event(
         )
 
     except Exception as e:
-        logger.error(f"Error processing API request event: {e}", exc_info=True)
+        logger.error("Error processing API request event: %s", e, exc_info=True)
         raise  # Re-raise so metrics will track the error
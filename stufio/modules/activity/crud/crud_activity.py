@@ -1,14 +1,19 @@
+import asyncio
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-import hashlib
 import logging
+import re
+from time import monotonic
 from typing import List, Optional, Dict, Any, Tuple
 from odmantic import ObjectId
+from pymongo import UpdateOne
 import uuid
 
 from stufio.core.config import get_settings
 from stufio.crud.mongo_base import CRUDMongo
 from stufio.crud.clickhouse_base import CRUDClickhouse
 from stufio.db.clickhouse_base import datetime_now_sec
+from stufio.db.redis import RedisClient
 from ..models import (
     IPBlacklist, UserActivity, UserSecurityProfile, 
     ClientFingerprint, SuspiciousActivity
@@ -18,6 +23,66 @@ from ..schemas import TrustedDeviceCreate, UserActivitySummary
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+# Prefix of the user_id recorded for unauthenticated requests
+ANON_USER_PREFIX = "anon-"
+
+# Sliding window of the distinct IPs a user came from: the IP is added with
+# the current time as score, entries older than the window are trimmed and
+# the number of IPs left is returned.
+# ARGV: client_ip, now (seconds), window_seconds
+RECENT_IPS_SCRIPT = """
+local now = tonumber(ARGV[2])
+redis.call('ZADD', KEYS[1], now, ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - tonumber(ARGV[3]))
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return redis.call('ZCARD', KEYS[1])
+"""
+
+# Seconds a user's IP stays in the recent IPs window
+RECENT_IPS_WINDOW = 24 * 60 * 60
+
+# An IP recorded for a user less than this many seconds ago is not recorded
+# again for a known device; its score in the 24h window would barely move
+RECENT_IP_RECORD_INTERVAL = 60
+RECENT_IP_RECORD_CACHE_SIZE = 100000
+
+# Endpoints whose access is checked in check_suspicious_activity; a
+# trailing "*" matches any suffix
+SENSITIVE_PATHS = (
+    settings.API_V1_STR + "/login/*",
+    settings.API_V1_STR + "/users/*",
+    settings.API_V1_STR + settings.API_ADMIN_STR + "/*",
+)
+_SENSITIVE_PREFIXES = tuple(p[:-1] for p in SENSITIVE_PATHS if p.endswith("*"))
+_SENSITIVE_EXACT = frozenset(p for p in SENSITIVE_PATHS if not p.endswith("*"))
+
+
+# Severity of a suspicious activity log is derived from its reason
+_HIGH_SEVERITY_RE = re.compile(r"password|auth|login|token|multiple|admin", re.IGNORECASE)
+_LOW_SEVERITY_RE = re.compile(r"new device|different location|unusual time", re.IGNORECASE)
+
+
+def _match_sensitive_path(path: str) -> Optional[str]:
+    """Return the SENSITIVE_PATHS entry matching path, if any"""
+    if path in _SENSITIVE_EXACT:
+        return path
+    # One C-level startswith over all prefixes before looking for the match
+    if not path.startswith(_SENSITIVE_PREFIXES):
+        return None
+    for prefix in _SENSITIVE_PREFIXES:
+        if path.startswith(prefix):
+            return prefix + "*"
+    return None
+
+
+FingerprintIndex = Dict[Tuple[str, str], ClientFingerprint]
+
+
+def _fingerprint_index(security_profile: UserSecurityProfile) -> FingerprintIndex:
+    """Index a profile's known fingerprints by (ip, user_agent)"""
+    return {(fp.ip, fp.user_agent): fp for fp in security_profile.known_fingerprints}
+
+
 class CRUDUserActivity:
     """CRUD for UserActivity with both MongoDB and ClickHouse support"""
 
@@ -27,6 +92,40 @@ class CRUDUserActivity:
         self.ip_blacklist = CRUDMongo(IPBlacklist)
         self.activity = CRUDClickhouse(UserActivity)
         self.suspicious = CRUDClickhouse(SuspiciousActivity)
+        # Table and collection names never change, so look them up once
+        self._activity_table = UserActivity.get_table_name()
+        self._suspicious_table = SuspiciousActivity.get_table_name()
+        self._profiles_collection = UserSecurityProfile.get_collection_name()
+        # Rows in ACTIVITY_COLUMNS / SUSPICIOUS_COLUMNS order, waiting for the flusher
+        self._activities: List[List[Any]] = []
+        self._suspicious_activities: List[List[Any]] = []
+        self._dropped_activities = 0
+        self._flusher: Optional[asyncio.Task] = None
+        self._recent_ips_script = None
+        # (user_id, ip) pairs recorded in the Redis window -> expires_at
+        self._recorded_ips: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        # Security profiles by user_id with their fingerprint index:
+        # user_id -> (profile, {(ip, user_agent): fingerprint}, expires_at)
+        self._profiles: "OrderedDict[str, Tuple[UserSecurityProfile, FingerprintIndex, float]]" = OrderedDict()
+        # Fingerprint hits not yet written to MongoDB:
+        # (user_id, ip, user_agent) -> (request_count delta, last_seen)
+        self._fingerprint_hits: Dict[Tuple[str, str, str], Tuple[int, datetime]] = {}
+        self._profile_flusher: Optional[asyncio.Task] = None
+
+    ACTIVITY_COLUMNS = [
+        "event_id", "timestamp", "date", "user_id", "path", "method",
+        "client_ip", "user_agent", "status_code", "process_time",
+        "is_authenticated",
+    ]
+
+    SUSPICIOUS_COLUMNS = [
+        "timestamp", "date", "user_id", "client_ip", "user_agent", "path",
+        "method", "status_code", "activity_type", "severity", "details",
+        "is_resolved", "resolution_id",
+    ]
+
+    # Let ClickHouse coalesce batches from all app instances server-side
+    ASYNC_INSERT_SETTINGS = {"async_insert": 1, "wait_for_async_insert": 0}
 
     async def create_activity(
         self,
@@ -38,94 +137,176 @@ class CRUDUserActivity:
         user_agent: str,
         status_code: int,
         process_time: float,
+        update_profile: bool = True,
     ) -> bool:
-        """Record an API request in ClickHouse for analytics"""
+        """
+        Record an API request in ClickHouse for analytics
+
+        The row is queued and inserted by a background flusher in batches of
+        up to ACTIVITY_FLUSH_BATCH_SIZE rows.
+
+        Pass update_profile=False to record the fingerprint separately with
+        update_user_security_profile, e.g. after checking it against the
+        user's known devices.
+        """
         try:
             is_authenticated = bool(user_id)
-            effective_user_id = user_id if user_id else f"anon-{client_ip}"
-
-            # Generate a unique ID for this activity
-            event_id = str(uuid.uuid4())
-            # Use timezone-aware UTC datetime
-            current_time = datetime_now_sec()
-
-            # Create the activity record with explicit timestamp and ID
-            api_request = UserActivity(
-                event_id=event_id,  # Set explicit ID
-                timestamp=current_time,  # Set explicit timestamp
-                date=current_time.replace(hour=0, minute=0, second=0, microsecond=0),
-                user_id=effective_user_id,
-                path=path,
-                method=method,
-                client_ip=client_ip,
-                user_agent=user_agent,
-                status_code=status_code,
-                process_time=process_time,
-                is_authenticated=is_authenticated,
-            )
+            effective_user_id = user_id if user_id else ANON_USER_PREFIX + client_ip
+
+            # ClickHouse DateTime columns take timezone-naive UTC values
+            current_time = datetime.now(timezone.utc).replace(microsecond=0, tzinfo=None)
+
+            # Build the row directly in ACTIVITY_COLUMNS order
+            row = [
+                str(uuid.uuid4()),
+                current_time,
+                current_time.replace(hour=0, minute=0, second=0, microsecond=0),
+                effective_user_id,
+                path,
+                method,
+                client_ip,
+                user_agent,
+                status_code,
+                process_time,
+                is_authenticated,
+            ]
+
+            # Queue the row; the background flusher inserts it in a batch
+            self._queue(self._activities, row)
 
-            # Use the dict_for_insert method to ensure proper data formatting
-            insert_data = api_request.dict_for_insert()
+            # Update user security profile if this is an authenticated user
+            if is_authenticated and update_profile:
+                await self.update_user_security_profile(effective_user_id, client_ip, user_agent)
 
-            # Ensure all datetime fields are timezone-naive for ClickHouse
-            for key, value in insert_data.items():
-                if isinstance(value, datetime) and value.tzinfo is not None:
-                    # Convert to UTC and remove timezone info
-                    insert_data[key] = value.astimezone(timezone.utc).replace(tzinfo=None)
+            return True
+        except Exception as e:
+            logger.error(f"Error recording API request in ClickHouse: {str(e)}", exc_info=True)
+            return False
 
-            # Get the ClickHouse client directly for more control
+    def _queue(self, pending: List[List[Any]], row: List[Any]) -> None:
+        """
+        Queue a row for the background flusher. The row is dropped instead
+        if ClickHouse is falling behind, so a stalled database cannot grow
+        the buffer without bound
+        """
+        if len(pending) < settings.activity_ACTIVITY_MAX_PENDING:
+            pending.append(row)
+        else:
+            self._dropped_activities += 1
+        self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        """Start the background flusher if it is not running"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self) -> None:
+        """Drain queued rows into ClickHouse with multi-row inserts"""
+        interval = settings.activity_ACTIVITY_FLUSH_INTERVAL
+        batch_size = settings.activity_ACTIVITY_FLUSH_BATCH_SIZE
+
+        while self._activities or self._suspicious_activities:
+            # Let rows accumulate unless a full batch is already waiting
+            if len(self._activities) < batch_size:
+                await asyncio.sleep(interval)
+            if not await self.flush(batch_size):
+                # ClickHouse is failing; wait before retrying the batch
+                await asyncio.sleep(interval)
+
+    async def flush(self, batch_size: Optional[int] = None) -> bool:
+        """
+        Insert up to batch_size queued rows per table (all of them by default).
+        A batch that fails is put back in the queue; returns False if any did
+        """
+        if self._dropped_activities:
+            logger.warning(
+                f"Dropped {self._dropped_activities} activities, "
+                f"more than {settings.activity_ACTIVITY_MAX_PENDING} were pending"
+            )
+            self._dropped_activities = 0
+
+        # One insert in flight at a time: the shared client allows a single
+        # query per session
+        flushed = True
+        for pending, table, columns in (
+            (self._activities, self._activity_table, self.ACTIVITY_COLUMNS),
+            (self._suspicious_activities, self._suspicious_table, self.SUSPICIOUS_COLUMNS),
+        ):
+            rows = pending[:batch_size]
+            del pending[:batch_size]
+            if rows and not await self._insert_rows(table, columns, rows):
+                self._requeue(pending, rows)
+                flushed = False
+
+        return flushed
+
+    def _requeue(self, pending: List[List[Any]], rows: List[List[Any]]) -> None:
+        """Put a failed batch back in front of the queue, within ACTIVITY_MAX_PENDING"""
+        room = max(settings.activity_ACTIVITY_MAX_PENDING - len(pending), 0)
+        if len(rows) > room:
+            self._dropped_activities += len(rows) - room
+            rows = rows[:room]
+        pending[:0] = rows
+
+    async def _insert_rows(self, table: str, columns: List[str], rows: List[List[Any]]) -> bool:
+        """Insert one batch of queued rows, logging instead of raising"""
+        try:
             client = await self.activity.client
-
-            # Extract column names and values for explicit insertion
-            columns = list(insert_data.keys())
-            values = [list(insert_data.values())]
-
-            # Insert using explicit column names
             await client.insert(
-                UserActivity.get_table_name(),
-                values,
-                column_names=columns  # Explicitly specify column names
+                table,
+                rows,
+                column_names=columns,
+                settings=self.ASYNC_INSERT_SETTINGS
             )
-
-            # Update user security profile if this is an authenticated user
-            if is_authenticated:
-                await self._update_user_security_profile(effective_user_id, client_ip, user_agent)
-
             return True
         except Exception as e:
-            logger.error(f"Error recording API request in ClickHouse: {str(e)}", exc_info=True)
+            logger.error(
+                f"❌ Failed to flush {len(rows)} rows to {table}: {str(e)}"
+            )
+            return False
 
-            # Add diagnostics to help debug the issue
-            try:
-                if 'insert_data' in locals():
-                    # Log the insert data
-                    logger.debug(f"Insert data: {insert_data}")
-
-                if 'client' in locals():
-                    # Get actual table structure
-                    schema_result = await client.query(f"DESCRIBE TABLE {UserActivity.get_table_name()}")
-                    schema_columns = [row[0] for row in schema_result.result_rows]
-                    logger.debug(f"ClickHouse table columns: {schema_columns}")
-
-                    if 'insert_data' in locals():
-                        logger.debug(f"Data columns: {list(insert_data.keys())}")
-
-                        # Show differences
-                        table_set = set(schema_columns)
-                        data_set = set(insert_data.keys())
-                        missing_in_data = table_set - data_set
-                        extra_in_data = data_set - table_set
-
-                        if missing_in_data:
-                            logger.error(f"Columns in table but missing in data: {missing_in_data}")
-                        if extra_in_data:
-                            logger.error(f"Columns in data but missing in table: {extra_in_data}")
-            except Exception as debug_e:
-                logger.error(f"Error during diagnostics: {debug_e}")
+    async def _get_cached_profile(
+        self, user_id: str
+    ) -> Tuple[Optional[UserSecurityProfile], FingerprintIndex]:
+        """
+        Get the user's security profile and its fingerprint index, reading
+        MongoDB only when it is not cached or its entry is older than
+        SECURITY_PROFILE_CACHE_TTL
+        """
+        now = monotonic()
+        cached = self._profiles.get(user_id)
+        if cached:
+            if cached[2] > now:
+                self._profiles.move_to_end(user_id)
+                return cached[0], cached[1]
+            del self._profiles[user_id]
 
-            return False
+        security_profile = await self.security_profiles.get_by_field("user_id", user_id)
+        if not security_profile:
+            return None, {}
+        return security_profile, self._cache_profile(security_profile)
+
+    def _cache_profile(self, security_profile: UserSecurityProfile) -> FingerprintIndex:
+        """
+        Store a profile in the cache with its fingerprint index, built once
+        here, evicting the least recently used
+        """
+        index = _fingerprint_index(security_profile)
+        self._profiles[security_profile.user_id] = (
+            security_profile,
+            index,
+            monotonic() + settings.activity_SECURITY_PROFILE_CACHE_TTL,
+        )
+        self._profiles.move_to_end(security_profile.user_id)
+        while len(self._profiles) > settings.activity_SECURITY_PROFILE_CACHE_SIZE:
+            self._profiles.popitem(last=False)
+        return index
 
-    async def _update_user_security_profile(
+    def _invalidate_profile(self, user_id: str) -> None:
+        """Drop a cached profile after it was changed in MongoDB directly"""
+        self._profiles.pop(user_id, None)
+
+    async def update_user_security_profile(
         self,
         user_id: str,
         client_ip: str,
@@ -133,7 +314,7 @@ class CRUDUserActivity:
     ) -> None:
         """Update the user's security profile with this client info"""
         # Get or create security profile
-        security_profile = await self.security_profiles.get_by_field("user_id", user_id)
+        security_profile, index = await self._get_cached_profile(user_id)
 
         if not security_profile:
             # Create new profile
@@ -146,35 +327,87 @@ class CRUDUserActivity:
                     )
                 ]
             )
-            await self.security_profiles.create(security_profile)
+            security_profile = await self.security_profiles.create(security_profile)
+            self._cache_profile(security_profile)
             return
 
-        # Check if this fingerprint exists
-        fingerprint_exists = False
-        for fp in security_profile.known_fingerprints:
-            if fp.ip == client_ip and fp.user_agent == user_agent:
-                # Update existing fingerprint
-                fp.last_seen = datetime.now(timezone.utc)
-                fp.request_count += 1
-                fingerprint_exists = True
-                break
-
-        if not fingerprint_exists:
-            # Add new fingerprint
-            security_profile.known_fingerprints.append(
-                ClientFingerprint(
-                    ip=client_ip,
-                    user_agent=user_agent
-                )
-            )
+        fp = index.get((client_ip, user_agent))
+        if fp:
+            # Count the hit in memory; the profile flusher writes the
+            # accumulated delta later with a single $inc
+            now = datetime.now(timezone.utc)
+            fp.last_seen = now
+            fp.request_count += 1
+
+            key = (user_id, client_ip, user_agent)
+            hits = self._fingerprint_hits.get(key)
+            self._fingerprint_hits[key] = ((hits[0] if hits else 0) + 1, now)
+            self._ensure_profile_flusher()
+            return
 
-        # Update the profile - EXCLUDE ID FIELD
-        update_data = security_profile.model_dump(exclude={"id"})
+        # Add new fingerprint
+        fingerprint = ClientFingerprint(
+            ip=client_ip,
+            user_agent=user_agent
+        )
         try:
-            await self.security_profiles.update(security_profile, update_data)
+            # Push only if no concurrent request (or instance) added the same
+            # fingerprint in the meantime, so the list never gets duplicates
+            collection = await self.security_profiles.engine.get_collection(self._profiles_collection)
+            await collection.update_one(
+                {
+                    "user_id": user_id,
+                    "known_fingerprints": {
+                        "$not": {"$elemMatch": {"ip": client_ip, "user_agent": user_agent}}
+                    },
+                },
+                {"$push": {"known_fingerprints": fingerprint.model_dump()}}
+            )
+            if (client_ip, user_agent) not in index:
+                security_profile.known_fingerprints.append(fingerprint)
+                index[(client_ip, user_agent)] = fingerprint
         except Exception as e:
+            # Reload the profile next time rather than keep unsaved changes
+            self._invalidate_profile(user_id)
             logger.error(f"Error updating security profile: {e}", exc_info=True)
 
+    def _ensure_profile_flusher(self) -> None:
+        """Start the background fingerprint counter flusher if it is not running"""
+        if self._profile_flusher is None or self._profile_flusher.done():
+            self._profile_flusher = asyncio.create_task(self._flush_pending_hits())
+
+    async def _flush_pending_hits(self) -> None:
+        """Write accumulated fingerprint hits every SECURITY_PROFILE_FLUSH_INTERVAL"""
+        while self._fingerprint_hits:
+            await asyncio.sleep(settings.activity_SECURITY_PROFILE_FLUSH_INTERVAL)
+            await self.flush_fingerprint_hits()
+
+    async def flush_fingerprint_hits(self) -> None:
+        """Write all pending fingerprint hits in one MongoDB bulk write"""
+        hits, self._fingerprint_hits = self._fingerprint_hits, {}
+        if not hits:
+            return
+
+        requests = [
+            UpdateOne(
+                {
+                    "user_id": user_id,
+                    "known_fingerprints": {"$elemMatch": {"ip": ip, "user_agent": user_agent}},
+                },
+                {
+                    "$inc": {"known_fingerprints.$.request_count": count},
+                    "$set": {"known_fingerprints.$.last_seen": last_seen},
+                },
+            )
+            for (user_id, ip, user_agent), (count, last_seen) in hits.items()
+        ]
+
+        try:
+            collection = await self.security_profiles.engine.get_collection(self._profiles_collection)
+            await collection.bulk_write(requests, ordered=False)
+        except Exception as e:
+            logger.error(f"❌ Failed to flush {len(requests)} fingerprint updates: {str(e)}")
+
     async def check_suspicious_activity(
         self,
         *,
@@ -187,73 +420,42 @@ class CRUDUserActivity:
     ) -> bool:
         """Check if this activity appears suspicious"""
         result = False
-        sensitive_paths = [
-            settings.API_V1_STR + "/login/*",
-            settings.API_V1_STR + "/users/*",
-            settings.API_V1_STR + settings.API_ADMIN_STR + "/*",
-        ]
+        sensitive_path = _match_sensitive_path(path)
 
-        if user_id:
-            # Get user security profile
-            security_profile = await self.security_profiles.get_by_field("user_id", user_id)
+        # A known device seen a moment ago cannot trip the unique IP check, so
+        # the common authenticated 2xx request returns without any I/O
+        if user_id and not self._is_recent_known_device(user_id, client_ip, user_agent):
+            # Count the user's distinct IPs first; the profile is only needed
+            # once that count is over the limit, or when Redis is down
+            max_ips = settings.activity_SECURITY_MAX_UNIQUE_IPS_PER_DAY
+            unique_ips = await self._count_recent_ips(user_id, client_ip)
+
+            if unique_ips is None or unique_ips > max_ips:
+                security_profile, index = await self._get_cached_profile(user_id)
 
-            if security_profile:
                 # Check if this is a known fingerprint
-                known_fingerprint = False
-                for fp in security_profile.known_fingerprints:
-                    if fp.ip == client_ip and fp.user_agent == user_agent:
-                        known_fingerprint = True
-                        break
-
-                # If this is an unknown fingerprint, check how many different fingerprints
-                # have been used recently
-                if not known_fingerprint:
-                    # Get recent activities for this user
-                    recent_time = datetime.now(timezone.utc) - timedelta(hours=24)
-
-                    # Query ClickHouse directly
-                    ch_client = await self.activity.client
-                    activities = await ch_client.query(
-                        f"""
-                        SELECT DISTINCT client_ip
-                        FROM {UserActivity.get_table_name()}
-                        WHERE user_id = {{user_id:String}}
-                        AND timestamp > {{recent_time:DateTime}}
-                        """,
-                        parameters={
-                            "user_id": user_id,
-                            "recent_time": recent_time
+                known_fingerprint = not security_profile or (client_ip, user_agent) in index
+
+                # Without Redis, scan ClickHouse for unknown fingerprints only
+                if not known_fingerprint and unique_ips is None:
+                    unique_ips = await self._count_recent_ips_in_clickhouse(user_id)
+
+                # Unknown fingerprint while too many IPs were used recently
+                if not known_fingerprint and unique_ips > max_ips:
+                    # Update security profile; only the changed fields are
+                    # written so pending fingerprint hits are not counted twice
+                    now = datetime.now(timezone.utc)
+                    security_profile.suspicious_activity_count += 1
+                    security_profile.last_suspicious_activity = now
+                    collection = await self.security_profiles.engine.get_collection(self._profiles_collection)
+                    await collection.update_one(
+                        {"user_id": user_id},
+                        {
+                            "$inc": {"suspicious_activity_count": 1},
+                            "$set": {"last_suspicious_activity": now}
                         }
                     )
 
-                    # Get unique IPs from result
-                    unique_ips = set(row[0] for row in activities.result_rows)
-
-                    # If too many unique IPs, mark as suspicious
-                    if len(unique_ips) > settings.activity_SECURITY_MAX_UNIQUE_IPS_PER_DAY:
-                        # Update security profile
-                        security_profile.suspicious_activity_count += 1
-                        security_profile.last_suspicious_activity = datetime.now(timezone.utc)
-                        await self.security_profiles.update(
-                            security_profile,
-                            security_profile.model_dump()
-                        )
-
-                        await self.create_suspicious_activity_log(
-                            user_id=user_id,
-                            client_ip=client_ip,
-                            user_agent=user_agent,
-                            path=path,
-                            method=method,
-                            status_code=status_code,
-                            reason="Too many different IPs used in a short time",
-                        )
-                        result = True
-
-            # Check for sensitive path access
-            for sensitive_path in sensitive_paths:
-                if (sensitive_path.endswith('*') and path.startswith(sensitive_path[:-1])) or path == sensitive_path:                
-                    # Log suspicious activity
                     await self.create_suspicious_activity_log(
                         user_id=user_id,
                         client_ip=client_ip,
@@ -261,29 +463,109 @@ class CRUDUserActivity:
                         path=path,
                         method=method,
                         status_code=status_code,
-                        reason=f"New device accessed sensitive endpoint: {sensitive_path}",
+                        reason="Too many different IPs used in a short time",
                     )
                     result = True
-                    break
+
+        # Check for sensitive path access
+        if user_id and sensitive_path:
+            # Log suspicious activity
+            await self.create_suspicious_activity_log(
+                user_id=user_id,
+                client_ip=client_ip,
+                user_agent=user_agent,
+                path=path,
+                method=method,
+                status_code=status_code,
+                reason=f"New device accessed sensitive endpoint: {sensitive_path}",
+            )
+            result = True
 
         # Check for failed login attempts
-        if status_code >= 400:
-            for sensitive_path in sensitive_paths:
-                if (sensitive_path.endswith('*') and path.startswith(sensitive_path[:-1])) or path == sensitive_path:
-                    await self.create_suspicious_activity_log(
-                        user_id=user_id,
-                        client_ip=client_ip,
-                        user_agent=user_agent,
-                        path=path,
-                        method=method,
-                        status_code=status_code,
-                        reason="Failed access attempt to sensitive endpoint",
-                    )
-                    result = True
-                    break
+        if status_code >= 400 and sensitive_path:
+            await self.create_suspicious_activity_log(
+                user_id=user_id,
+                client_ip=client_ip,
+                user_agent=user_agent,
+                path=path,
+                method=method,
+                status_code=status_code,
+                reason="Failed access attempt to sensitive endpoint",
+            )
+            result = True
 
         return result
 
+    def _is_recent_known_device(self, user_id: str, client_ip: str, user_agent: str) -> bool:
+        """
+        True if the cached profile knows this fingerprint and the IP was
+        recorded for the user within RECENT_IP_RECORD_INTERVAL. Only looks at
+        in-process caches, never at Redis or MongoDB
+        """
+        expires_at = self._recorded_ips.get((user_id, client_ip))
+        if not expires_at or expires_at <= monotonic():
+            return False
+
+        cached = self._profiles.get(user_id)
+        return bool(cached) and (client_ip, user_agent) in cached[1]
+
+    def _mark_ip_recorded(self, user_id: str, client_ip: str) -> None:
+        """Remember that the IP was just recorded in the user's Redis window"""
+        key = (user_id, client_ip)
+        self._recorded_ips[key] = monotonic() + RECENT_IP_RECORD_INTERVAL
+        self._recorded_ips.move_to_end(key)
+        if len(self._recorded_ips) > RECENT_IP_RECORD_CACHE_SIZE:
+            self._recorded_ips.popitem(last=False)
+
+    async def _count_recent_ips(self, user_id: str, client_ip: str) -> Optional[int]:
+        """
+        Record client_ip for the user and return the number of distinct IPs
+        seen in the last 24 hours, using a Redis sliding window. Returns None
+        if Redis is unavailable, see _count_recent_ips_in_clickhouse
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            redis_client = await RedisClient()
+            if self._recent_ips_script is None:
+                self._recent_ips_script = redis_client.register_script(RECENT_IPS_SCRIPT)
+
+            unique_ips = int(await self._recent_ips_script(
+                keys=[f"{settings.activity_SECURITY_REDIS_PREFIX}recent_ips:{user_id}"],
+                args=[client_ip, int(now.timestamp()), RECENT_IPS_WINDOW],
+                client=redis_client,
+            ))
+            self._mark_ip_recorded(user_id, client_ip)
+            return unique_ips
+        except Exception as e:
+            logger.error(f"Error counting recent IPs in Redis: {str(e)}")
+            return None
+
+    async def _count_recent_ips_in_clickhouse(self, user_id: str) -> int:
+        """
+        Count the user's distinct IPs of the last 24 hours from user_activity.
+        The count stops one past SECURITY_MAX_UNIQUE_IPS_PER_DAY, which is all
+        callers compare
+        """
+        # uniqUpTo(N) stops tracking past N distinct values (N <= 100)
+        max_ips = int(settings.activity_SECURITY_MAX_UNIQUE_IPS_PER_DAY)
+        unique_ips_expr = f"uniqUpTo({max_ips})(client_ip)" if max_ips <= 100 else "uniqExact(client_ip)"
+
+        recent_time = datetime.now(timezone.utc) - timedelta(seconds=RECENT_IPS_WINDOW)
+        ch_client = await self.activity.client
+        activities = await ch_client.query(
+            f"""
+            SELECT {unique_ips_expr}
+            FROM {self._activity_table}
+            WHERE user_id = {{user_id:String}}
+            AND timestamp > {{recent_time:DateTime}}
+            """,
+            parameters={
+                "user_id": user_id,
+                "recent_time": recent_time
+            }
+        )
+        return activities.result_rows[0][0] if activities.result_rows else 0
+
     async def create_suspicious_activity_log(
         self,
         *,
@@ -306,35 +588,28 @@ class CRUDUserActivity:
 
             # Determine severity based on reason keywords
             severity = "medium"  # Default
-            high_severity_keywords = ["password", "auth", "login", "token", "multiple", "admin"]
-            low_severity_keywords = ["new device", "different location", "unusual time"]
-
-            # Check for high severity keywords
-            if any(keyword in reason.lower() for keyword in high_severity_keywords):
+            if _HIGH_SEVERITY_RE.search(reason):
                 severity = "high"
-            # Check for low severity keywords
-            elif any(keyword in reason.lower() for keyword in low_severity_keywords):
+            elif _LOW_SEVERITY_RE.search(reason):
                 severity = "low"
 
-            # Create suspicious activity record with timezone-naive datetimes for ClickHouse
-            suspicious = SuspiciousActivity(
-                timestamp=now.replace(tzinfo=None),  # Remove timezone for ClickHouse
-                date=date.replace(tzinfo=None),      # Remove timezone for ClickHouse
-                user_id=user_id,
-                client_ip=client_ip,
-                user_agent=user_agent,
-                path=path,
-                method=method,
-                status_code=status_code,
-                activity_type="suspicious_behavior",
-                severity=severity,
-                details=reason,
-                is_resolved=False,
-                resolution_id=None,
-            )
-
-            # Insert into ClickHouse
-            await self.suspicious.create(suspicious)
+            # Queue the row in SUSPICIOUS_COLUMNS order with timezone-naive
+            # datetimes for ClickHouse; it is inserted with the next batch
+            self._queue(self._suspicious_activities, [
+                now.replace(tzinfo=None),
+                date.replace(tzinfo=None),
+                user_id,
+                client_ip,
+                user_agent,
+                path,
+                method,
+                status_code,
+                "suspicious_behavior",
+                severity,
+                reason,
+                False,
+                None,
+            ])
 
             # Add structured logging for monitoring
             logger.warning(
@@ -356,39 +631,64 @@ class CRUDUserActivity:
         *,
         user_id: str,
         skip: int = 0,
-        limit: int = 100
+        limit: int = 100,
+        before: Optional[datetime] = None,
+        before_id: Optional[str] = None
     ) -> Tuple[List[UserActivity], int]:
-        """Get recent activities for a user"""
+        """
+        Get recent activities for a user
+
+        Pass the timestamp and event_id of the last activity of the previous
+        page as before/before_id to page by key instead of by offset.
+
+        The total stops counting at ACTIVITY_COUNT_LIMIT rows (or the end of
+        the requested page, if further), so it is a lower bound for users
+        with a very long history.
+        """
         try:
             # Use self.activity instead of db
             client = await self.activity.client
+            table_name = self._activity_table
+            count_limit = max(settings.activity_ACTIVITY_COUNT_LIMIT, skip + limit + 1)
+
+            parameters = {"user_id": user_id, "limit": limit, "skip": skip}
+            keyset = ""
+            if before is not None:
+                # Keyset pagination: rows after the cursor, no OFFSET scan
+                keyset = """
+                  AND timestamp <= {before:DateTime64(3)}
+                  AND (timestamp, event_id) < ({before:DateTime64(3)}, {before_id:String})
+                """
+                parameters.update(before=before, before_id=before_id or "", skip=0)
+
+            # One after the other: the shared client runs a single query per
+            # session at a time, so gathering them would fail the listing
             count = await client.query(
-                f"SELECT count() FROM {UserActivity.get_table_name()} WHERE user_id = {{user_id:String}}",
-                parameters={"user_id": user_id}
+                f"""
+                SELECT count() AS total
+                FROM (
+                    SELECT 1 FROM {table_name}
+                    WHERE user_id = {{user_id:String}}
+                    LIMIT {{count_limit:UInt32}}
+                )
+                """,
+                parameters={"user_id": user_id, "count_limit": count_limit}
             )
-
-            # Convert generator to list before accessing index
-            count_results = list(count.named_results())
-            total = count_results[0]["count()"] if count_results else 0
-
-            # Use self.activity for the main query
-            table_name = UserActivity.get_table_name()
             activities = await client.query(
                 f"""
                 SELECT *
                 FROM {table_name}
-                WHERE user_id = {{user_id:String}}
-                ORDER BY timestamp DESC
+                WHERE user_id = {{user_id:String}}{keyset}
+                ORDER BY timestamp DESC, event_id DESC
                 LIMIT {{limit:UInt32}} OFFSET {{skip:UInt32}}
                 """,
-                parameters={
-                    "user_id": user_id,
-                    "limit": limit,
-                    "skip": skip
-                },
+                parameters=parameters,
             )
 
-            return [UserActivity(**activity) for activity in list(activities.named_results())], total
+            # The count is a single scalar; read it without building row dicts
+            total = count.result_rows[0][0] if count.result_rows else 0
+
+            return [UserActivity(**activity) for activity in activities.named_results()], total
         except Exception as e:
             logger.error(f"Error getting user activities: {str(e)}")
             return [], 0
@@ -401,27 +701,25 @@ class CRUDUserActivity:
             # Use self.activity instead of self.clickhouse
             client = await self.activity.client
             result = await client.query(
-                """
+                f"""
                 SELECT 
                     toDate(timestamp) AS day,
                     count() AS request_count,
                     avg(process_time) AS avg_response_time,
                     uniq(path) AS unique_endpoints,
                     countIf(status_code >= 400) AS error_count
-                FROM {table}
-                WHERE user_id = {user_id} AND date >= today() - {days}
+                FROM {self._activity_table}
+                WHERE user_id = {{user_id:String}} AND date >= today() - {{days:UInt32}}
                 GROUP BY day
                 ORDER BY day DESC
                 """,
                 parameters={
-                    "table": UserActivity.get_table_name(),
                     "user_id": user_id,
                     "days": days,
                 },
             )
 
-            rows = list(result.named_results())
-            return [UserActivitySummary(**summary) for summary in rows]
+            return [UserActivitySummary(**summary) for summary in result.named_results()]
         except Exception as e:
             logger.error(f"Error getting user activity summary: {str(e)}")
             return []
@@ -453,11 +751,12 @@ class CRUDUserActivity:
             return {}
 
         # Create new fingerprint
+        now = datetime.now(timezone.utc)
         new_fingerprint = ClientFingerprint(
             ip=device.ip,
             user_agent=device.user_agent,
-            first_seen=datetime.now(timezone.utc),
-            last_seen=datetime.now(timezone.utc),
+            first_seen=now,
+            last_seen=now,
             request_count=1
         )
 
@@ -467,7 +766,7 @@ class CRUDUserActivity:
         fingerprint_dict["device_name"] = device.device_name
 
         # Use direct collection update instead of update() method
-        collection = await self.security_profiles.engine.get_collection(UserSecurityProfile.get_collection_name())
+        collection = await self.security_profiles.engine.get_collection(self._profiles_collection)
         await collection.update_one(
             {"user_id": profile.user_id},
             {
@@ -476,6 +775,7 @@ class CRUDUserActivity:
             },
             upsert=False
         )
+        self._invalidate_profile(profile.user_id)
 
         return fingerprint_dict
 
@@ -486,11 +786,12 @@ class CRUDUserActivity:
     ) -> bool:
         """Remove a trusted device from user's security profile"""
         # Use self.security_profiles instead of self.mongo
-        collection = await self.security_profiles.engine.get_collection(UserSecurityProfile.get_collection_name())
+        collection = await self.security_profiles.engine.get_collection(self._profiles_collection)
         result = await collection.update_one(
             {"user_id": user_id},
             {"$pull": {"known_fingerprints": {"id": device_id}}}
         )
+        self._invalidate_profile(user_id)
         if result.modified_count == 0:
             return False
         return True
@@ -506,40 +807,34 @@ class CRUDUserActivity:
             # Use self.suspicious instead of self.clickhouse
             client = await self.suspicious.client
             result = await client.query(
-                """
+                f"""
                 SELECT
                     timestamp,
                     user_id,
                     client_ip,
                     user_agent,
+                    path,
+                    method,
+                    status_code,
                     activity_type,
                     severity,
                     details,
                     is_resolved,
                     resolution_id
-                FROM {table}
-                WHERE user_id = {user_id}
+                FROM {self._suspicious_table}
+                WHERE user_id = {{user_id:String}}
                 ORDER BY timestamp DESC
-                LIMIT {limit} OFFSET {skip}
+                LIMIT {{limit:UInt32}} OFFSET {{skip:UInt32}}
                 """,
                 parameters={
-                    "table": SuspiciousActivity.get_table_name(),
                     "user_id": user_id,
                     "limit": limit,
                     "skip": skip
                 }
             )
 
-            # Process the results
-            activities = list(result.named_results())
-
-            # Generate unique IDs for each record (ClickHouse doesn't have them)
-            for activity in activities:
-                # Create a deterministic ID from the data
-                id_str = f"{activity['user_id']}:{activity['timestamp']}:{activity['client_ip']}"
-                activity["id"] = str(hashlib.md5(id_str.encode()).hexdigest())
-
-            return activities
+            # Ids are derived by SuspiciousActivityResponse when serialized
+            return list(result.named_results())
         except Exception as e:
             logger.error(f"Error getting suspicious activities from ClickHouse: {str(e)}")
             return []
@@ -554,37 +849,32 @@ class CRUDUserActivity:
             # Use self.suspicious instead of self.clickhouse
             client = await self.suspicious.client
             result = await client.query(
-                """
+                f"""
                 SELECT
                     timestamp,
                     user_id,
                     client_ip,
                     user_agent,
+                    path,
+                    method,
+                    status_code,
                     activity_type,
                     severity,
                     details,
                     is_resolved,
                     resolution_id
-                FROM {table}
+                FROM {self._suspicious_table}
                 ORDER BY timestamp DESC
-                LIMIT {limit} OFFSET {skip}
+                LIMIT {{limit:UInt32}} OFFSET {{skip:UInt32}}
                 """,
                 parameters={
-                    "table": SuspiciousActivity.get_table_name(),
                     "limit": limit,
                     "skip": skip
                 }
             )
 
-            # Process the results
-            activities = list(result.named_results())
-
-            # Generate unique IDs for each record
-            for activity in activities:
-                id_str = f"{activity['user_id']}:{activity['timestamp']}:{activity['client_ip']}"
-                activity["id"] = str(hashlib.md5(id_str.encode()).hexdigest())
-
-            return activities
+            # Ids are derived by SuspiciousActivityResponse when serialized
+            return list(result.named_results())
         except Exception as e:
             logger.error(f"Error getting all suspicious activities from ClickHouse: {str(e)}")
             return []
@@ -620,13 +910,20 @@ class CRUDUserActivity:
             details=details
         )
 
-        # Use self.suspicious's insert method
-        await self.suspicious.create(activity)
+        # Hand the row to ClickHouse's async insert buffer instead of
+        # waiting for the part to be written
         activity_dict = activity.model_dump()
+        client = await self.suspicious.client
+        await client.insert(
+            self._suspicious_table,
+            [[activity_dict[column] for column in self.SUSPICIOUS_COLUMNS]],
+            column_names=self.SUSPICIOUS_COLUMNS,
+            settings=self.ASYNC_INSERT_SETTINGS
+        )
 
         # Update user's security profile using self.security_profiles
         # For MongoDB, use timezone-aware UTC datetime
-        collection = await self.security_profiles.engine.get_collection(UserSecurityProfile.get_collection_name())
+        collection = await self.security_profiles.engine.get_collection(self._profiles_collection)
         await collection.update_one(
             {"user_id": user_id},
             {
@@ -635,6 +932,7 @@ class CRUDUserActivity:
             },
             upsert=True
         )
+        self._invalidate_profile(user_id)
 
         return activity_dict
 
@@ -697,14 +995,16 @@ class CRUDUserActivity:
         reason: str = "Suspicious activity detected"
     ) -> bool:
         """Restrict a user due to suspicious activity"""
-        # Get the user profile first
-        profile = await self.security_profiles.get_by_field("user_id", user_id)
-        if not profile:
+        # Set the flag in place instead of loading and saving the profile,
+        # which could overwrite fingerprint updates written in between
+        collection = await self.security_profiles.engine.get_collection(self._profiles_collection)
+        result = await collection.update_one(
+            {"user_id": user_id},
+            {"$set": {"is_restricted": True}}
+        )
+        if result.matched_count == 0:
             return False
-
-        # Update using CRUD methods
-        profile.is_restricted = True
-        await self.security_profiles.update(profile, {"is_restricted": True})
+        self._invalidate_profile(user_id)
 
         # Also log this as a high severity event
         await self.record_suspicious_activity(
@@ -729,10 +1029,15 @@ class CRUDUserActivity:
         try:
             # Use self.suspicious instead of self.clickhouse
             client = await self.suspicious.client
+            table = self._suspicious_table
+            parameters = {"days": days}
+
+            # Run the reports one after the other on the shared client, which
+            # allows a single query per session at a time
 
             # Get overall stats
             summary_result = await client.query(
-                """
+                f"""
                 SELECT 
                     count() AS total_activities,
                     countIf(severity = 'high') AS high_severity_count,
@@ -741,74 +1046,59 @@ class CRUDUserActivity:
                     uniq(user_id) AS affected_users,
                     uniq(client_ip) AS unique_ips
                 FROM {table}
-                WHERE date >= today() - {days}
+                WHERE date >= today() - {{days:UInt32}}
                 """,
-                parameters={
-                    "table": SuspiciousActivity.get_table_name(),
-                    "days": days
-                }
+                parameters=parameters
             )
 
-            summary = summary_result.first_row_as_dict()
-
             # Get activity trend by day
             trend_result = await client.query(
-                """
+                f"""
                 SELECT 
                     date,
                     count() AS activities,
                     countIf(severity = 'high') AS high_severity
                 FROM {table} 
-                WHERE date >= today() - {days}
+                WHERE date >= today() - {{days:UInt32}}
                 GROUP BY date
                 ORDER BY date
                 """,
-                parameters={
-                    "table": SuspiciousActivity.get_table_name(),
-                    "days": days
-                }
+                parameters=parameters
             )
 
-            trend = list(trend_result.named_results())
-
             # Most common activity types
             types_result = await client.query(
-                """
+                f"""
                 SELECT 
                     activity_type,
                     count() AS count
                 FROM {table}
-                WHERE date >= today() - {days}
+                WHERE date >= today() - {{days:UInt32}}
                 GROUP BY activity_type
                 ORDER BY count DESC
                 """,
-                parameters={
-                    "table": SuspiciousActivity.get_table_name(),
-                    "days": days
-                }
+                parameters=parameters
             )
 
-            types = list(types_result.named_results())
-
             # Top users with suspicious activities
             users_result = await client.query(
-                """
+                f"""
                 SELECT 
                     user_id,
                     count() AS activity_count,
                     max(timestamp) AS latest_activity
                 FROM {table}
-                WHERE date >= today() - {days}
+                WHERE date >= today() - {{days:UInt32}}
                 GROUP BY user_id
                 ORDER BY activity_count DESC
                 LIMIT 10
                 """,
-                parameters={
-                    "table": SuspiciousActivity.get_table_name(),
-                    "days": days
-                }
+                parameters=parameters
             )
 
+            summary = summary_result.first_row_as_dict()
+            trend = list(trend_result.named_results())
+            types = list(types_result.named_results())
             users = list(users_result.named_results())
 
             return {
@@ -1,10 +1,13 @@
-from typing import List, Tuple
+from typing import Any, Dict, List, Tuple
 import logging
+import orjson
 from clickhouse_connect.driver.asyncclient import AsyncClient
+from stufio.core.config import get_settings
 from stufio.crud.clickhouse_base import CRUDClickhouse
+from stufio.db.redis import RedisClient
 from ..models import UserActivity
-from ..schemas import ErrorReport, PathStatistics
 
+settings = get_settings()
 logger = logging.getLogger(__name__)
 
 class CRUDAnalytics:
@@ -16,11 +19,47 @@ class CRUDAnalytics:
         """Initialize ClickHouse handler"""
         self.clickhouse = CRUDClickhouse(UserActivity)
 
+    async def _query_cached(
+        self,
+        key: str,
+        ttl: int,
+        query: str,
+        parameters: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
+        """
+        Run a report query, serving it from Redis for ttl seconds.
+
+        Reports are global aggregates with no per-user data, so the cache key
+        only depends on the report parameters. Redis errors fall back to
+        querying ClickHouse directly.
+        """
+        cache_key = f"{settings.activity_ANALYTICS_CACHE_PREFIX}{key}"
+        redis_client = None
+        try:
+            redis_client = await RedisClient()
+            cached = await redis_client.get(cache_key)
+            if cached:
+                return orjson.loads(cached)
+        except Exception as e:
+            logger.warning(f"Error reading analytics cache: {str(e)}")
+
+        client = await self.clickhouse.client
+        result = await client.query(query, parameters=parameters)
+        rows = list(result.named_results())
+
+        if redis_client is not None:
+            try:
+                await redis_client.set(cache_key, orjson.dumps(rows), ex=ttl)
+            except Exception as e:
+                logger.warning(f"Error writing analytics cache: {str(e)}")
+
+        return rows
+
     async def get_path_statistics(
         self,
         path: str = None,
         hours: int = 24
-    ) -> List[PathStatistics]:
+    ) -> List[Dict[str, Any]]:
         """
         Get statistics for a specific API path or all paths
         
@@ -29,14 +68,19 @@ class CRUDAnalytics:
             hours: Number of hours to analyze
             
         Returns:
-            Dict with path statistics
+            List of PathStatistics rows; validated once by the response model
         """
         try:
-            where_clause = "WHERE date >= today() - 1"
+            where_clause = (
+                "WHERE date >= toDate(now() - interval {hours:UInt32} hour)"
+                " AND timestamp >= now() - interval {hours:UInt32} hour"
+            )
             if path:
-                where_clause += f" AND path = '{path}'"
+                where_clause += " AND path = {path:String}"
 
-            result = await self.clickhouse.client.query(
+            return await self._query_cached(
+                f"path-report:{hours}:{path or '*'}",
+                settings.activity_ANALYTICS_PATH_REPORT_CACHE_TTL,
                 f"""
                 SELECT 
                     path,
@@ -50,10 +94,9 @@ class CRUDAnalytics:
                 GROUP BY path
                 ORDER BY request_count DESC
                 LIMIT 100
-                """
+                """,
+                parameters={"hours": hours, "path": path},
             )
-
-            return list([PathStatistics(**row) for row in list(result.named_results())])
         except Exception as e:
             logger.error(f"Error getting path statistics: {str(e)}")
             return []
@@ -62,7 +105,7 @@ class CRUDAnalytics:
         self,
         *,
         days: int = 1
-    ) -> List[ErrorReport]:
+    ) -> List[Dict[str, Any]]:
         """
         Get report of API errors
         
@@ -70,25 +113,25 @@ class CRUDAnalytics:
             days: Number of days to analyze
             
         Returns:
-            Dict with error report
+            List of ErrorReport rows; validated once by the response model
         """
         try:
-            result =  await self.clickhouse.client.query(
-                """
+            return await self._query_cached(
+                f"error-report:{days}",
+                settings.activity_ANALYTICS_ERROR_REPORT_CACHE_TTL,
+                f"""
                 SELECT 
                     path,
                     status_code,
                     count() AS error_count,
                     max(timestamp) AS latest_occurrence
-                FROM {table}
-                WHERE date >= today() - {days} AND status_code >= 400
+                FROM {UserActivity.get_table_name()}
+                WHERE date >= today() - {{days:UInt32}} AND status_code >= 400
                 GROUP BY path, status_code
                 ORDER BY error_count DESC
                 """,
-                parameters={"days": days, "table": UserActivity.get_table_name()},
+                parameters={"days": days},
             )
-
-            return list([ErrorReport(**row) for row in list(result.named_results())])
         except Exception as e:
             logger.error(f"Error getting error report: {str(e)}")
             return []
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
 from typing import Dict, Any, Optional, List, Tuple
@@ -12,6 +13,11 @@ settings = get_settings()
 logger = logging.getLogger(__name__)
 
 
+def _path_matches(pattern: str, path: str) -> bool:
+    """Match a path against an exact endpoint or a "prefix*" pattern"""
+    return (pattern[-1:] == '*' and path.startswith(pattern[:-1])) or path == pattern
+
+
 class CRUDRateLimit:
     """CRUD operations for rate limits and overrides"""
 
@@ -21,6 +27,8 @@ class CRUDRateLimit:
         self.config = CRUDMongo(RateLimitConfig)
         self.user_limits = CRUDMongo(UserRateLimit)  # Add this line
         self.clickhouse = CRUDClickhouse(RateLimit)
+        self._violations: List[List[Any]] = []
+        self._flusher: Optional[asyncio.Task] = None
 
     async def get_user_limit_status(
         self,
@@ -33,64 +41,143 @@ class CRUDRateLimit:
         Get current rate limit status for user.
         Returns remaining requests and reset time.
         """
-        try:
-            # Check for override
-            override = await self._get_user_override(user_id=user_id, path=path)
-            if override:
-                now = datetime.now(timezone.utc)
-                if override.get("expires_at") and override.get("expires_at") < now:
-                    # Override expired, delete it
-                    await self.mongo.remove(override["id"])
-                else:
-                    # Use override values
-                    max_requests = override.get("max_requests", max_requests)
-                    window_seconds = override.get("window_seconds", window_seconds)
+        statuses = await self.get_user_limit_status_bulk(
+            user_id=user_id,
+            limits=[(path, max_requests, window_seconds)]
+        )
+        return statuses[0]
 
-            key = f"user:{user_id}:{path}"
-            now = datetime.now(timezone.utc)
-            window_start = now - timedelta(seconds=window_seconds)
+    async def get_user_limit_status_bulk(
+        self,
+        *,
+        user_id: str,
+        limits: List[Tuple[str, int, int]]
+    ) -> List[RateLimitStatus]:
+        """
+        Get current rate limit status for several paths with one ClickHouse query.
 
-            # Get client first
-            client = await self.clickhouse.client
+        Args:
+            user_id: User to check
+            limits: List of (path, max_requests, window_seconds); path may end with "*"
 
-            # Query total requests in current window
-            result = await client.query(
-                """
-                SELECT sum(counter) as total_count,
-                       max(window_end) as latest_expiry
-                FROM rate_limits
-                WHERE key = {key} AND window_start >= {window_start}
-                """,
-                parameters={
-                    "key": key,
-                    "window_start": window_start
-                }
-            )
-
-            total_count = result.first_row[0] if result.row_count > 0 else 0
-            reset_at = result.first_row[1] if result.row_count > 0 and result.first_row[1] else now + timedelta(seconds=window_seconds)
+        Returns:
+            List of RateLimitStatus in the same order as limits
+        """
+        now = datetime.now(timezone.utc)
 
-            # Calculate remaining requests
-            remaining = max(0, max_requests - total_count)
+        try:
+            # Fetch user overrides while acquiring the ClickHouse client
+            user_overrides, client = await asyncio.gather(
+                self.mongo.get_multi(user_id=user_id),
+                self.clickhouse.client,
+            )
 
-            return RateLimitStatus(
-                total_allowed=max_requests,
-                remaining=remaining,
-                reset_at=reset_at,
-                window_seconds=window_seconds
+            # Apply user overrides, fetched once for all paths
+            overrides = {}
+            expired = []
+            for override in user_overrides:
+                override = override.model_dump()
+                if override.get("expires_at") and override["expires_at"] < now:
+                    expired.append(override["id"])
+                    continue
+                overrides[override["path"]] = override
+
+            effective = []
+            for path, max_requests, window_seconds in limits:
+                override = overrides.get(path) or overrides.get("*")
+                if override:
+                    max_requests = override.get("max_requests", max_requests)
+                    window_seconds = override.get("window_seconds", window_seconds)
+                effective.append((path, max_requests, window_seconds))
+
+            max_window = max((window for _, _, window in effective), default=0)
+
+            # Per-minute request counts over the widest window; expired
+            # overrides are deleted while the query runs
+            result, *_ = await asyncio.gather(
+                client.query(
+                    """
+                    SELECT
+                        path,
+                        countMerge(request_count) AS count,
+                        dateDiff('second', minute, now()) AS age
+                    FROM user_rate_limits
+                    WHERE user_id = {user_id:String}
+                      AND minute >= now() - interval {window:UInt32} second
+                    GROUP BY path, minute
+                    """,
+                    parameters={"user_id": user_id, "window": max_window},
+                ),
+                *(self.mongo.remove(override_id) for override_id in expired),
             )
+            rows = result.result_rows
+
+            statuses = []
+            for path, max_requests, window_seconds in effective:
+                total_count = 0
+                oldest_age = None
+                for row_path, count, age in rows:
+                    if age <= window_seconds and _path_matches(path, row_path):
+                        total_count += count
+                        oldest_age = age if oldest_age is None else max(oldest_age, age)
+
+                reset_in = window_seconds - oldest_age if oldest_age is not None else window_seconds
+                statuses.append(RateLimitStatus(
+                    total_allowed=max_requests,
+                    remaining=max(0, max_requests - total_count),
+                    reset_at=now + timedelta(seconds=max(reset_in, 0)),
+                    window_seconds=window_seconds
+                ))
+
+            return statuses
         except Exception as e:
             logger.error(f"Error getting user limit status: {str(e)}")
             # Return a default status in case of error
-            return RateLimitStatus(
-                total_allowed=max_requests,
-                remaining=max_requests,
-                reset_at=datetime.now(timezone.utc) + timedelta(seconds=window_seconds),
-                window_seconds=window_seconds
-            )
+            return [
+                RateLimitStatus(
+                    total_allowed=max_requests,
+                    remaining=max_requests,
+                    reset_at=now + timedelta(seconds=window_seconds),
+                    window_seconds=window_seconds
+                )
+                for _, max_requests, window_seconds in limits
+            ]
 
-    async def _record_violation(
+    VIOLATION_COLUMNS = [
+        "timestamp", "date", "key", "type", "limit", "attempts",
+        "user_id", "client_ip", "endpoint",
+    ]
+
+    def _violation_row(
+        self,
+        key: str,
+        type: str,
+        limit: int,
+        attempts: int,
+        ip: Optional[str] = None,
+        user_id: Optional[str] = None,
+        endpoint: Optional[str] = None
+    ) -> List[Any]:
+        """Build a rate_limit_violations row in VIOLATION_COLUMNS order"""
+        now = datetime.now(timezone.utc)
+        return [
+            now,
+            now.replace(hour=0, minute=0, second=0, microsecond=0),
+            key,
+            type,
+            limit,
+            attempts,
+            user_id,
+            ip,
+            endpoint,
+        ]
+
+    # Let ClickHouse buffer the small background inserts server-side
+    ASYNC_INSERT_SETTINGS = {"async_insert": 1, "wait_for_async_insert": 0}
+
+    def queue_violation(
         self,
+        *,
         key: str,
         type: str,
         limit: int,
@@ -99,51 +186,47 @@ class CRUDRateLimit:
         user_id: Optional[str] = None,
         endpoint: Optional[str] = None
     ) -> None:
-        """Record a rate limit violation in ClickHouse for analysis"""
+        """
+        Queue a rate limit violation for a batched background insert.
+        Never blocks the request path.
+        """
+        self._violations.append(
+            self._violation_row(key, type, limit, attempts, ip, user_id, endpoint)
+        )
+        self._ensure_flusher()
+
+    def _ensure_flusher(self) -> None:
+        """Start the background flusher if it is not running"""
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self) -> None:
+        """Drain queued violations into ClickHouse with multi-row inserts"""
+        interval = settings.activity_RATE_LIMIT_FLUSH_INTERVAL
+        batch_size = settings.activity_RATE_LIMIT_FLUSH_BATCH_SIZE
+
+        while self._violations:
+            # Let rows accumulate so they go out in one insert
+            await asyncio.sleep(interval)
+            await self.flush(batch_size)
+
+    async def flush(self, batch_size: Optional[int] = None) -> None:
+        """Insert up to batch_size queued violations (all of them by default)"""
+        rows = self._violations[:batch_size]
+        del self._violations[:batch_size]
+        if not rows:
+            return
+
         try:
-            now = datetime.now(timezone.utc)
-            # Get client first
             client = await self.clickhouse.client
-
-            data = {
-                "timestamp": now,
-                "date": now.replace(hour=0, minute=0, second=0, microsecond=0),
-                "key": key,
-                "type": type,
-                "limit": limit,
-                "attempts": attempts,
-                "user_id": user_id,
-                "client_ip": ip,
-                "endpoint": endpoint
-            }
-
-            # Insert violation record
             await client.insert(
                 'rate_limit_violations',
-                [list(data.values())],
-                column_names=list(data.keys())
+                rows,
+                column_names=self.VIOLATION_COLUMNS,
+                settings=self.ASYNC_INSERT_SETTINGS
             )
         except Exception as e:
-            # Just log the error, don't let this affect the main flow
-            logger.error(f"❌ Failed to record rate limit violation: {str(e)}")
-
-    async def _get_user_override(
-        self,
-        user_id: str,
-        path: str
-    ) -> Optional[Dict[str, Any]]:
-        """Get rate limit override for user if exists"""
-        # First try exact path match
-        override = await self.mongo.get_by_fields(user_id=user_id, path=path)
-        if override:
-            return override.model_dump()
-
-        # Then try wildcard match
-        override = await self.mongo.get_by_fields(user_id=user_id, path="*")
-        if override:
-            return override.model_dump()
-
-        return None
+            logger.error(f"❌ Failed to flush {len(rows)} rate limit violations: {str(e)}")
 
     async def create_user_override(
         self,
@@ -372,8 +455,8 @@ class CRUDRateLimit:
             )
 
             return {
-                "summary": list(summary.named_results())[0] if summary.row_count > 0 else {},
-                "violations": list(violations.named_results())[0] if violations.row_count > 0 else {},
+                "summary": next(summary.named_results(), {}),
+                "violations": next(violations.named_results(), {}),
                 "by_type": list(by_type.named_results()),
                 "top_ips": list(top_ips.named_results()),
                 "by_day": list(by_day.named_results()),
@@ -390,32 +473,6 @@ class CRUDRateLimit:
                 "view_stats": []
             }
 
-    async def get_rate_limit_config(
-        self,
-        *,
-        endpoint: str
-    ) -> Optional[Dict[str, Any]]:
-        """Get rate limit configuration for an endpoint from MongoDB"""
-        try:
-            # Get engine from config CRUD
-            cursor = (
-                self.config.engine.get_collection(RateLimitConfig)
-                .find({"active": True})
-                .sort("endpoint", -1)
-            )
-
-            # Find the best matching configuration
-            async for cfg in cursor:
-                if (cfg["endpoint"][-1:] == '*' and endpoint.startswith(cfg["endpoint"][:-1])) or endpoint == cfg["endpoint"]:
-                    # Found a matching config
-                    return cfg
-
-            # No specific config found
-            return None
-        except Exception as e:
-            logger.error(f"Error fetching rate limit config: {str(e)}")
-            return None
-
     async def get_all_rate_limit_configs(
         self,
         *,
@@ -425,25 +482,40 @@ class CRUDRateLimit:
     ) -> List[RateLimitConfigResponse]:
         """Get all rate limit configurations"""
         try:
-            query = {"active": True} if active_only else {}
-            cursor = (
-                self.config.engine.get_collection(RateLimitConfig)
-                .find(query)
-                .sort("endpoint", 1)
-                .skip(skip)
-                .limit(limit)
+            return await self.fetch_rate_limit_configs(
+                skip=skip, limit=limit, active_only=active_only
             )
-            configs = await cursor.to_list(length=limit)
-
-            # Convert ObjectId to string for each document
-            for config in configs:
-                config["id"] = str(config.pop("_id"))
-
-            return [RateLimitConfigResponse(**config) for config in configs]
         except Exception as e:
             logger.error(f"Error fetching rate limit configs: {str(e)}")
             return []
 
+    async def fetch_rate_limit_configs(
+        self,
+        *,
+        skip: int = 0,
+        limit: int = 100,
+        active_only: bool = False,
+    ) -> List[RateLimitConfigResponse]:
+        """
+        Get rate limit configurations, raising on database errors so the
+        config cache can tell a failed load from an empty collection
+        """
+        query = {"active": True} if active_only else {}
+        cursor = (
+            self.config.engine.get_collection(RateLimitConfig)
+            .find(query)
+            .sort("endpoint", 1)
+            .skip(skip)
+            .limit(limit)
+        )
+        configs = await cursor.to_list(length=limit)
+
+        # Convert ObjectId to string for each document
+        for config in configs:
+            config["id"] = str(config.pop("_id"))
+
+        return [RateLimitConfigResponse(**config) for config in configs]
+
     async def create_rate_limit_config(
         self,
         *,
@@ -493,6 +565,7 @@ class CRUDRateLimit:
         except Exception as e:
             logger.error(f"Error creating rate limit config: {str(e)}")
             # Return minimal valid response
+            now = datetime.now(timezone.utc)
             return RateLimitConfigResponse(
                 id="error",
                 endpoint=endpoint,
@@ -501,8 +574,8 @@ class CRUDRateLimit:
                 active=active,
                 bypass_roles=bypass_roles or [],
                 description=description,
-                created_at=datetime.now(timezone.utc),
-                updated_at=datetime.now(timezone.utc)
+                created_at=now,
+                updated_at=now
             )
 
     async def update_rate_limit_config(
@@ -573,238 +646,6 @@ class CRUDRateLimit:
             logger.error(f"Error deleting rate limit config: {str(e)}")
             return False
 
-    async def check_ip_limit(
-        self, 
-        *,
-        ip: str,
-        window_seconds: int
-    ) -> bool:
-        """Quickly check if an IP is already rate limited based on recent violations"""
-        try:
-            # Get client first
-            client = await self.clickhouse.client
-
-            # First, check for recent violations (super fast)
-            recent_time = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
-            result = await client.query(
-                """
-                SELECT 1
-                FROM rate_limit_violations
-                WHERE client_ip = {ip:String}
-                  AND timestamp >= {recent_time:DateTime}
-                  AND type = 'ip'
-                LIMIT 1
-                """,
-                parameters={"ip": ip, "recent_time": recent_time},
-            )
-
-            # If a violation exists, block immediately
-            if result.row_count > 0:
-                return False
-
-            # Otherwise, let it pass and do detailed checking in background
-            return True
-        except Exception as e:
-            logger.error(f"Error checking IP rate limit: {str(e)}")
-            return True  # Allow if error to prevent false blocks
-
-    async def update_ip_request_count(
-        self,
-        *,
-        ip: str,
-        max_requests: int,
-        window_seconds: int
-    ) -> None:
-        """Update IP request count and record violations in background"""
-        try:
-            # Get client first
-            client = await self.clickhouse.client
-
-            # Check if request count exceeds limit
-            result = await client.query(
-                """
-                SELECT countMerge(request_count) as count
-                FROM ip_rate_limits
-                WHERE ip = {ip:String}
-                AND minute >= now() - interval {window:UInt32} second
-                """,
-                parameters={"ip": ip, "window": window_seconds},
-            )
-
-            # Process results
-            count_results = list(result.named_results())
-            count = count_results[0]["count"] if count_results else 0
-
-            # Record violation if limit exceeded
-            if count >= max_requests:
-                await self._record_violation(
-                    key=f"ip:{ip}",
-                    type="ip",
-                    limit=max_requests,
-                    attempts=count,
-                    ip=ip
-                )
-        except Exception as e:
-            logger.error(f"Error in background IP tracking: {str(e)}")
-
-    async def check_user_limit(
-        self,
-        *,
-        user_id: str,
-        path: str,
-        window_seconds: int
-    ) -> bool:
-        """Quickly check if a user is already rate limited based on recent violations"""
-        try:
-            # Get client first
-            client = await self.clickhouse.client
-
-            # First, check for recent violations (super fast)
-            recent_time = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
-            result = await client.query(
-                """
-                SELECT 1
-                FROM rate_limit_violations
-                WHERE user_id = {user_id:String}
-                  AND endpoint = {path:String}
-                  AND timestamp >= {recent_time:DateTime}
-                  AND type = 'user'
-                LIMIT 1
-                """,
-                parameters={"user_id": user_id, "path": path, "recent_time": recent_time},
-            )
-
-            # If a violation exists, block immediately
-            if result.row_count > 0:
-                return False
-
-            # Otherwise, let it pass and do detailed checking in background
-            return True
-        except Exception as e:
-            logger.error(f"Error checking user rate limit: {str(e)}")
-            return True  # Allow if error to prevent false blocks
-
-    async def update_user_request_count(
-        self,
-        *,
-        user_id: str,
-        path: str,
-        max_requests: int,
-        window_seconds: int
-    ) -> None:
-        """Update user request count and record violations in background"""
-        try:
-            # Get client first
-            client = await self.clickhouse.client
-
-            # Query the user-specific materialized view for detailed check
-            result = await client.query(
-                """
-                SELECT countMerge(request_count) as count
-                FROM user_rate_limits
-                WHERE user_id = {user_id:String}
-                AND path = {path:String}
-                AND minute >= now() - interval {window:UInt32} second
-                """,
-                parameters={"user_id": user_id, "path": path, "window": window_seconds},
-            )
-
-            # Process results
-            count_results = list(result.named_results())
-            count = count_results[0]["count"] if count_results else 0
-
-            # Record violation if limit exceeded
-            if count >= max_requests:
-                await self._record_violation(
-                    key=f"user:{user_id}:{path}",
-                    type="user",
-                    limit=max_requests,
-                    attempts=count,
-                    user_id=user_id,
-                    endpoint=path
-                )
-        except Exception as e:
-            logger.error(f"Error in background user tracking: {str(e)}")
-
-    async def check_endpoint_limit(
-        self,
-        *,
-        path: str,
-        client_ip: str,
-        window_seconds: int
-    ) -> bool:
-        """Quickly check if an endpoint is already rate limited for this IP based on recent violations"""
-        try:
-            # Get client first
-            client = await self.clickhouse.client
-
-            # First, check for recent violations (super fast)
-            recent_time = datetime.now(timezone.utc) - timedelta(seconds=window_seconds)
-            result = await client.query(
-                """
-                SELECT 1
-                FROM rate_limit_violations
-                WHERE client_ip = {ip:String}
-                  AND endpoint = {path:String}
-                  AND timestamp >= {recent_time:DateTime}
-                  AND type = 'endpoint'
-                LIMIT 1
-                """,
-                parameters={"ip": client_ip, "path": path, "recent_time": recent_time},
-            )
-
-            # If a violation exists, block immediately
-            if result.row_count > 0:
-                return False
-
-            # Otherwise, let it pass and do detailed checking in background
-            return True
-        except Exception as e:
-            logger.error(f"Error checking endpoint rate limit: {str(e)}")
-            return True  # Allow if error to prevent false blocks
-
-    async def update_endpoint_request_count(
-        self,
-        *,
-        path: str,
-        client_ip: str,
-        max_requests: int,
-        window_seconds: int
-    ) -> None:
-        """Update endpoint request count and record violations in background"""
-        try:
-            # Get client first
-            client = await self.clickhouse.client
-
-            # Query the endpoint-specific materialized view for detailed check
-            result = await client.query(
-                """
-                SELECT countMerge(request_count) as count
-                FROM endpoint_rate_limits
-                WHERE path = {path:String}
-                AND client_ip = {ip:String}
-                AND minute >= now() - interval {window:UInt32} second
-                """,
-                parameters={"path": path, "ip": client_ip, "window": window_seconds},
-            )
-
-            # Process results
-            count_results = list(result.named_results())
-            count = count_results[0]["count"] if count_results else 0
-
-            # Record violation if limit exceeded
-            if count >= max_requests:
-                await self._record_violation(
-                    key=f"endpoint:{path}:{client_ip}",
-                    type="endpoint",
-                    limit=max_requests,
-                    attempts=count,
-                    ip=client_ip,
-                    endpoint=path
-                )
-        except Exception as e:
-            logger.error(f"Error in background endpoint tracking: {str(e)}")
-
     async def set_user_rate_limited(
         self,
         user_id: str,
@@ -813,7 +654,8 @@ class CRUDRateLimit:
     ) -> bool:
         """Set a user as rate limited in MongoDB"""
         try:
-            limited_until = datetime.now(timezone.utc) + timedelta(minutes=duration_minutes)
+            now = datetime.now(timezone.utc)
+            limited_until = now + timedelta(minutes=duration_minutes)
 
             # Try to get existing record
             record = await self.user_limits.get_by_fields(user_id=user_id)
@@ -823,7 +665,7 @@ class CRUDRateLimit:
                 record.is_limited = True
                 record.reason = reason
                 record.limited_until = limited_until
-                record.updated_at = datetime.now(timezone.utc)
+                record.updated_at = now
                 await self.user_limits.update(record)
                 return True
             else:
@@ -863,29 +705,5 @@ class CRUDRateLimit:
             logger.error(f"Error removing user rate limit: {str(e)}")
             return False
 
-    async def is_user_rate_limited(
-        self,
-        user_id: str
-    ) -> Tuple[bool, Optional[str]]:
-        """Check if a user is rate limited from MongoDB record"""
-        try:
-            # Use the proper model through our CRUD helper
-            record = await self.user_limits.get_by_fields(user_id=user_id)
-
-            if record and record.is_limited:
-                # Check if limitation has expired
-                if record.limited_until and record.limited_until > datetime.now(timezone.utc):
-                    return True, record.reason or "Rate limited"
-                else:
-                    # Limitation has expired, update the record
-                    record.is_limited = False
-                    await self.user_limits.update(record)
-
-            return False, None
-        except Exception as e:
-            logger.error(f"Error checking user rate limit status: {str(e)}")
-            return False, None
-
-
 # Create singleton instance
 crud_rate_limit = CRUDRateLimit()
@@ -1,4 +1,7 @@
 import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 from fastapi import Request, Response
 from fastapi.responses import JSONResponse
 from starlette.types import ASGIApp
@@ -10,6 +13,7 @@ from stufio.modules.events import BaseStufioMiddleware
 
 from stufio.api import deps
 from stufio.core.config import get_settings
+from stufio.db.redis import RedisClient
 from ..crud import crud_rate_limit, crud_activity
 from ..services.rate_limit import rate_limit_service
 
@@ -17,6 +21,52 @@ from ..services.rate_limit import rate_limit_service
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+# Paths excluded from rate limiting in addition to the base middleware defaults
+RATE_LIMIT_EXCLUDED_PATHS = (
+    settings.API_V1_STR + "/docs",
+    settings.API_V1_STR + "/openapi.json",
+)
+
+# Paths whose bearer token must not be used to identify the user
+TOKEN_IGNORED_PATHS = frozenset({settings.API_V1_STR + "/login/claim"})
+
+# Decoded token subjects keyed by token digest: digest -> (user_id, expires_at)
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE_TTL = 300  # Upper bound when the token carries no usable "exp"
+_token_cache: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+
+
+def _get_token_subject(token: str) -> Optional[str]:
+    """
+    Return the token subject, verifying the token only on a cache miss.
+    Entries are evicted when the token expires or the cache is full.
+    """
+    digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    now = time.time()
+
+    cached = _token_cache.get(digest)
+    if cached:
+        if cached[1] > now:
+            _token_cache.move_to_end(digest)
+            return cached[0]
+        del _token_cache[digest]
+
+    token_data = deps.get_token_payload(token)
+    user_id = token_data.sub
+    if not user_id:
+        return user_id
+
+    expires_at = now + TOKEN_CACHE_TTL
+    exp = getattr(token_data, "exp", None)
+    if isinstance(exp, (int, float)):
+        expires_at = min(expires_at, exp)
+
+    _token_cache[digest] = (user_id, expires_at)
+    if len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+
+    return user_id
+
 
 class RateLimitingMiddleware(BaseStufioMiddleware):
     """
@@ -28,25 +78,18 @@ class RateLimitingMiddleware(BaseStufioMiddleware):
     3. Endpoint-specific rate limiting
     4. IP blacklist checking
     
-    Rate limit data is stored in Redis for fast checks and in MongoDB for persistent storage.
+    Rate limit counters live in Redis so each check is a single round trip;
+    persistent limits are mirrored to MongoDB and violations are written to
+    ClickHouse in background.
     """
     def __init__(
         self, 
         app: ASGIApp,
         excluded_paths: Optional[List[str]] = None
     ):
-        # Define additional paths to exclude from rate limiting
-        rate_limit_excluded = [
-            settings.API_V1_STR + "/docs",
-            settings.API_V1_STR + "/openapi.json",
-        ]
-        
         # Combine with default excluded paths from base middleware
-        if excluded_paths:
-            excluded_paths.extend(rate_limit_excluded)
-        else:
-            excluded_paths = rate_limit_excluded
-            
+        excluded_paths = [*(excluded_paths or []), *RATE_LIMIT_EXCLUDED_PATHS]
+
         super().__init__(app, excluded_paths=excluded_paths)
         
         # Initialize and pre-warm the cache
@@ -55,9 +98,11 @@ class RateLimitingMiddleware(BaseStufioMiddleware):
     async def _init_rate_limit_cache(self):
         """Initialize and warm up the rate limit cache."""
         try:
-            # Pre-fetch common endpoint configurations
-            await rate_limit_service.warm_config_cache(
-                db_fetch_func=crud_rate_limit.get_all_rate_limit_configs
+            # Pre-compile the endpoint configurations
+            await rate_limit_service.load_config_matcher(
+                db_fetch_func=crud_rate_limit.fetch_rate_limit_configs,
+                active_only=True,
+                limit=1000,
             )
             logger.info("Rate limit configuration cache initialized")
         except Exception as e:
@@ -77,22 +122,29 @@ class RateLimitingMiddleware(BaseStufioMiddleware):
         
         # Get current user if authenticated
         user_id = None
-        auth_header = request.headers.get("authorization")
-        if (
-            auth_header
-            and auth_header.startswith("Bearer ")
-            and path not in [settings.API_V1_STR + "/login/claim"]
-        ):
-            token = auth_header.replace("Bearer ", "")
+        token = None
+        if path not in TOKEN_IGNORED_PATHS:
+            # Scan the raw ASGI headers instead of building a Headers mapping
+            for name, value in request.scope["headers"]:
+                if name == b"authorization":
+                    if value.startswith(b"Bearer "):
+                        token = value[7:].decode("latin-1")
+                    break
+
+        if token:
             try:
-                token_data = deps.get_token_payload(token)
-                user_id = token_data.sub
+                user_id = _get_token_subject(token)
             except Exception as e:
                 logger.debug(f"Error extracting user from token: {e}")
 
-        # Check if user is already rate limited in MongoDB
+        # Acquire Redis once and reuse it for every check below
+        redis_client = await RedisClient()
+
+        # Check if user is already rate limited (mirrored to Redis on violation)
         if user_id:
-            is_limited, reason = await crud_rate_limit.is_user_rate_limited(user_id)
+            is_limited, reason = await rate_limit_service.is_limited(
+                f"user:{user_id}", redis_client=redis_client
+            )
             if is_limited:
                 raise RateLimitException(
                     detail=reason or "Rate limited",
@@ -103,6 +155,7 @@ class RateLimitingMiddleware(BaseStufioMiddleware):
         is_blacklisted, reason = await rate_limit_service.is_ip_blacklisted(
             ip=client_ip,
             db_fetch_func=crud_activity.check_ip_blacklisted,
+            redis_client=redis_client,
             ip_address=client_ip  # Add the missing ip_address parameter here
         )
 
@@ -112,16 +165,48 @@ class RateLimitingMiddleware(BaseStufioMiddleware):
                 rate_limit_type="ip_blacklist"
             )
 
-        # IP-based rate limiting with Redis
-        ip_allowed = await rate_limit_service.check_limit(
-            key=f"ip:{client_ip}",
-            max_requests=settings.activity_RATE_LIMIT_IP_MAX_REQUESTS,
-            window_seconds=settings.activity_RATE_LIMIT_IP_WINDOW_SECONDS,
-            record_type="ip",
-            record_data={"ip": client_ip},
+        # IP-based rate limiting
+        checks = [{
+            "key": f"ip:{client_ip}",
+            "max_requests": settings.activity_RATE_LIMIT_IP_MAX_REQUESTS,
+            "window_seconds": settings.activity_RATE_LIMIT_IP_WINDOW_SECONDS,
+            "record_type": "ip",
+            "record_data": {"ip": client_ip},
+        }]
+
+        # User-based rate limiting
+        if user_id:
+            checks.append({
+                "key": f"user:{user_id}:{normalized_path}",
+                "max_requests": settings.activity_RATE_LIMIT_USER_MAX_REQUESTS,
+                "window_seconds": settings.activity_RATE_LIMIT_USER_WINDOW_SECONDS,
+                "record_type": "user",
+                "record_data": {"user_id": user_id, "path": normalized_path},
+            })
+
+        # Endpoint-specific rate limiting
+        endpoint_config = await rate_limit_service.get_cached_config(
+            endpoint=normalized_path,
+            db_fetch_func=crud_rate_limit.fetch_rate_limit_configs,
+            active_only=True,
+            limit=1000,
         )
 
-        if not ip_allowed:
+        if endpoint_config:
+            checks.append({
+                "key": f"endpoint:{normalized_path}:{client_ip}",
+                "max_requests": endpoint_config.get("max_requests", 100),
+                "window_seconds": endpoint_config.get("window_seconds", 60),
+                "record_type": "endpoint",
+                "record_data": {"ip": client_ip, "path": normalized_path},
+            })
+
+        # All counters are checked in a single Redis round trip
+        blocked = await rate_limit_service.check_limits(checks, redis_client=redis_client)
+        if not blocked:
+            return
+
+        if blocked["record_type"] == "ip":
             # Store persistent rate limit in MongoDB
             asyncio.create_task(crud_rate_limit.set_user_rate_limited(
                 user_id=f"ip:{client_ip}",
@@ -134,52 +219,30 @@ class RateLimitingMiddleware(BaseStufioMiddleware):
                 rate_limit_type="ip"
             )
 
-        # User-based rate limiting with Redis
-        if user_id:
-            user_allowed = await rate_limit_service.check_limit(
-                key=f"user:{user_id}:{normalized_path}",
-                max_requests=settings.activity_RATE_LIMIT_USER_MAX_REQUESTS,
-                window_seconds=settings.activity_RATE_LIMIT_USER_WINDOW_SECONDS,
-                record_type="user",
-                record_data={"user_id": user_id, "path": normalized_path},
+        if blocked["record_type"] == "user":
+            reason = f"User rate limit exceeded for {normalized_path}"
+            await rate_limit_service.set_limited(
+                key=f"user:{user_id}",
+                reason=reason,
+                duration_seconds=10 * 60,
+                redis_client=redis_client,
             )
+            # Store persistent rate limit in MongoDB
+            asyncio.create_task(crud_rate_limit.set_user_rate_limited(
+                user_id=user_id,
+                reason=reason,
+                duration_minutes=10
+            ))
 
-            if not user_allowed:
-                # Store persistent rate limit in MongoDB
-                asyncio.create_task(crud_rate_limit.set_user_rate_limited(
-                    user_id=user_id,
-                    reason=f"User rate limit exceeded for {normalized_path}",
-                    duration_minutes=10
-                ))
-
-                raise RateLimitException(
-                    detail="Too many requests - please slow down",
-                    rate_limit_type="user"
-                )
-
-        # Endpoint-specific rate limiting with Redis
-        endpoint_config = await rate_limit_service.get_cached_config(
-            endpoint=normalized_path,
-            db_fetch_func=crud_rate_limit.get_rate_limit_config,
-        )
-
-        if endpoint_config:
-            max_requests = endpoint_config.get("max_requests", 100)
-            window_seconds = endpoint_config.get("window_seconds", 60)
-
-            endpoint_allowed = await rate_limit_service.check_limit(
-                key=f"endpoint:{normalized_path}:{client_ip}",
-                max_requests=max_requests,
-                window_seconds=window_seconds,
-                record_type="endpoint",
-                record_data={"ip": client_ip, "path": normalized_path}
+            raise RateLimitException(
+                detail="Too many requests - please slow down",
+                rate_limit_type="user"
             )
 
-            if not endpoint_allowed:
-                raise RateLimitException(
-                    detail=f"Rate limit exceeded for {normalized_path}",
-                    rate_limit_type="endpoint"
-                )
+        raise RateLimitException(
+            detail=f"Rate limit exceeded for {normalized_path}",
+            rate_limit_type="endpoint"
+        )
 
     async def _handle_exception(self, request: Request, exception: Exception) -> Response:
         """
@@ -0,0 +1,29 @@
+from stufio.core.migrations.base import MongoMigrationScript
+import logging
+
+class DropRedundantOverrideIndex(MongoMigrationScript):
+    name = "drop_redundant_override_index"
+    description = "Drop the standalone user_id index on rate_limit_overrides"
+    migration_type = "schema"
+    order = 10
+
+    async def run(self, db):
+        try:
+            existing_collections = await db.list_collection_names()
+            if "rate_limit_overrides" not in existing_collections:
+                return True
+
+            # The unique (user_id, path) index already serves user_id lookups
+            existing_indexes = await db.rate_limit_overrides.list_indexes().to_list(None)
+            for idx in existing_indexes:
+                if dict(idx["key"]) == {"user_id": 1}:
+                    logging.info(f"Dropping redundant {idx['name']} index")
+                    await db.command({
+                        "dropIndexes": "rate_limit_overrides",
+                        "index": idx["name"]
+                    })
+
+            return True
+        except Exception as e:
+            logging.error(f"Error dropping redundant override index: {str(e)}")
+            raise
@@ -0,0 +1,30 @@
+from stufio.core.migrations.base import MongoMigrationScript
+import logging
+
+class DropOverridePathIndex(MongoMigrationScript):
+    name = "drop_override_path_index"
+    description = "Drop the standalone path index on rate_limit_overrides"
+    migration_type = "schema"
+    order = 20
+
+    async def run(self, db):
+        try:
+            existing_collections = await db.list_collection_names()
+            if "rate_limit_overrides" not in existing_collections:
+                return True
+
+            # Overrides are always looked up by user_id first, so a path-only
+            # index is never used and "*" makes it very low-selectivity
+            existing_indexes = await db.rate_limit_overrides.list_indexes().to_list(None)
+            for idx in existing_indexes:
+                if dict(idx["key"]) == {"path": 1}:
+                    logging.info(f"Dropping unused {idx['name']} index")
+                    await db.command({
+                        "dropIndexes": "rate_limit_overrides",
+                        "index": idx["name"]
+                    })
+
+            return True
+        except Exception as e:
+            logging.error(f"Error dropping override path index: {str(e)}")
+            raise
@@ -30,8 +30,8 @@ class RateLimitOverride(MongoBase):
     Rate limit override for specific users
     Stored in MongoDB collection 'rate_limit_overrides'
     """
-    user_id: str = MongoField(index=True)
-    path: str = MongoField(default="*", index=True)  # * means all paths
+    user_id: str  # Covered by the (user_id, path) index prefix
+    path: str = "*"  # * means all paths
     max_requests: int
     window_seconds: int
     created_at: datetime = MongoField(default_factory=datetime_now_sec)
@@ -1,11 +1,13 @@
 from fastapi import FastAPI
 from typing import List, Any, Tuple
+import asyncio
 import logging
 
 from stufio.core.module_registry import ModuleInterface
 from stufio.core.stufioapi import StufioAPI
 from stufio.modules.events import KafkaModuleMixin
 from .api import api_router
+from .crud import crud_activity, crud_rate_limit
 from .middleware import RateLimitingMiddleware
 from .__version__ import __version__
 
@@ -22,6 +24,17 @@ class ActivityModule(KafkaModuleMixin, ModuleInterface):
         # Register routes
         app.include_router(api_router, prefix=self.routes_prefix)
 
+        # Write out rows still buffered by the background flushers
+        app.add_event_handler("shutdown", self.flush_pending_writes)
+
+    async def flush_pending_writes(self) -> None:
+        """Flush queued activity, fingerprint and violation writes."""
+        await asyncio.gather(
+            crud_activity.flush(),
+            crud_activity.flush_fingerprint_hits(),
+            crud_rate_limit.flush(),
+        )
+
     def get_middlewares(self) -> List[Tuple]:
         """Return middleware classes for this module.
 
@@ -7,6 +7,7 @@ from stufio.modules.events.schemas.base import BaseEventPayload
 
 class UserActivityResponse(BaseModel):
     """Response model for user activity"""
+    event_id: Optional[str] = None
     timestamp: datetime
     date: date
     user_id: Optional[str] = None
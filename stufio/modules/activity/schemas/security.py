@@ -1,5 +1,7 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, computed_field
 from datetime import datetime
+from functools import cached_property
+import hashlib
 from typing import Optional, List
 
 
@@ -44,10 +46,20 @@ class SuspiciousActivityCreate(SuspiciousActivityBase):
 
 class SuspiciousActivityResponse(SuspiciousActivityBase):
     """Response schema for suspicious activity"""
-    id: str
     is_resolved: bool = False
     resolution_id: Optional[str] = None
 
+    @computed_field
+    @cached_property
+    def id(self) -> str:
+        """
+        Stable id derived from the row (ClickHouse has none), computed only
+        when the response is serialized. BLAKE2b since this is not a
+        security boundary
+        """
+        id_str = f"{self.user_id}:{self.timestamp}:{self.client_ip}"
+        return hashlib.blake2b(id_str.encode(), digest_size=16).hexdigest()
+
 
 class UserSecurityProfileBase(BaseModel):
     """Base schema for user security profile"""
@@ -1,298 +1,343 @@
-import logging
 import asyncio
-from time import time
-from typing import Optional, Dict, Any, Tuple
-import json
+import logging
+import re
+from time import monotonic
+from typing import Optional, Dict, Any, List, Pattern, Tuple
 
 from stufio.core.config import get_settings
 from stufio.db.redis import RedisClient
-from stufio.db.mongo import MongoJSONEncoder, serialize_mongo_doc
 from ..crud.crud_rate_limit import crud_rate_limit
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 
+# Atomic fixed-window counters for several keys in one round trip.
+# ARGV holds (max_requests, window_seconds) pairs in KEYS order. Keys are
+# incremented in order and the script stops at the first exceeded limit,
+# returning its 1-based index and count, or {0, 0} when all are allowed.
+CHECK_LIMITS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local current = redis.call('INCR', key)
+    if current == 1 then
+        redis.call('EXPIRE', key, ARGV[i * 2])
+    end
+    if current > tonumber(ARGV[i * 2 - 1]) then
+        return {i, current}
+    end
+end
+return {0, 0}
+"""
+
+# Every counter key carries this hash tag so one script call can touch the
+# ip, user and endpoint counters together on Redis Cluster, where keys from
+# different slots would fail with CROSSSLOT
+CHECK_KEY_HASH_TAG = "{check}"
+
+# Seconds to wait before retrying a failed configuration reload
+CONFIG_RELOAD_RETRY_SECONDS = 5
+
+
 class RateLimitService:
     """Service for handling rate limiting with Redis + ClickHouse"""
 
+    _check_script = None
+    # (compiled endpoint regex, configs in alternative order)
+    _config_matcher: Optional[Tuple[Optional[Pattern], List[Dict[str, Any]]]] = None
+    _config_matcher_expires_at: float = 0.0
+    # Created on first use so it binds to the running event loop
+    _config_matcher_lock: Optional[asyncio.Lock] = None
+
     @staticmethod
     async def check_limit(
         key: str,
         max_requests: int,
         window_seconds: int,
         record_type=None,
-        record_data=None
+        record_data=None,
+        redis_client=None,
     ) -> bool:
         """
-        Check if a rate limit is exceeded and record in background
+        Check if a single rate limit is exceeded, see check_limits
+        
+        Returns:
+            bool: True if request should be allowed, False if rate limited
+        """
+        blocked = await RateLimitService.check_limits(
+            [{
+                "key": key,
+                "max_requests": max_requests,
+                "window_seconds": window_seconds,
+                "record_type": record_type,
+                "record_data": record_data,
+            }],
+            redis_client=redis_client,
+        )
+        return blocked is None
+
+    @staticmethod
+    async def check_limits(
+        checks: List[Dict[str, Any]],
+        redis_client=None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Check several rate limits using Redis fixed-window counters
+        
+        All counters are updated by one Lua script call. Violations are
+        queued and persisted to ClickHouse in background, so the request
+        path costs a single Redis round trip.
         
         Args:
-            key: Unique identifier (e.g., "ip:192.168.1.1" or "user:123:path")
-            max_requests: Maximum number of requests allowed
-            window_seconds: Time window in seconds
-            record_type: Type of record (ip, user, endpoint)
-            record_data: Additional data to record
+            checks: Ordered list of dicts with keys:
+                key: Unique identifier (e.g., "ip:192.168.1.1" or "user:123:path")
+                max_requests: Maximum number of requests allowed
+                window_seconds: Time window in seconds
+                record_type: Type of record (ip, user, endpoint)
+                record_data: Additional data to record
+            redis_client: Redis client already acquired by the caller
             
         Returns:
-            bool: True if request should be allowed, False if rate limited
+            dict: The first exceeded check, or None if request should be allowed
         """
+        if not checks:
+            return None
 
-        PREFIX_DISALLOWED = "D"
-        PREFIX_ALLOWED = "A"
-        CACHE_TTL = settings.activity_RATE_LIMIT_DECISION_TTL
-        redis_client = await RedisClient()
-        now = time()
-
-        # Create Redis key with proper prefix and namespace
-        redis_key = f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}check:{key}"
-
-        is_allowed = None
-
-        # Try to get cached decision
-        cached_value = await redis_client.get(redis_key)
-        if cached_value:
-            if cached_value.startswith(PREFIX_DISALLOWED + ":"):
-                try:
-                    block_until = float(cached_value.split(":", 1)[1])
-                    # If block is still active
-                    if block_until > now:
-                        is_allowed = False
-                except:
-                    pass
-            elif cached_value == PREFIX_ALLOWED:
-                is_allowed = True
-
-        if record_type and record_data:
-            # Record analytics in background
-            asyncio.create_task(
-                RateLimitService._record_analytics(
-                    record_type=record_type,
-                    record_data=record_data,
-                    max_requests=max_requests,
-                    window_seconds=window_seconds
-                )
-            )
+        # Resolve the prefix once; settings stay live since admins can change them
+        key_prefix = f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}{CHECK_KEY_HASH_TAG}:"
+        redis_keys = [key_prefix + check["key"] for check in checks]
+        args = []
+        for check in checks:
+            args.extend((check["max_requests"], check["window_seconds"]))
 
-            # Cache the result in Redis
         try:
-            if is_allowed == True:
-                # Cache a "pass" result for 20 seconds
-                await redis_client.set(redis_key, PREFIX_ALLOWED, ex=CACHE_TTL)
-            elif is_allowed == None:
-                if record_type and record_data:
-                    is_allowed = await RateLimitService._check_limit(
-                        record_type=record_type,
-                        record_data=record_data,
-                        window_seconds=window_seconds
-                    )
-                    if is_allowed:
-                        # Cache an "allow" result for X seconds
-                        await redis_client.set(redis_key, PREFIX_ALLOWED, ex=CACHE_TTL)
-                    elif is_allowed == False:
-                        # Cache a "block" result for {window_seconds} seconds
-                        await redis_client.set(
-                            redis_key,
-                            f"{PREFIX_DISALLOWED}:{now + window_seconds}",
-                            ex=window_seconds,
-                        )
-                    else:
-                        # impossible to check limit
-                        logger.warning(f"Can't check rate limit for key {key}")    
-                        is_allowed = True
-            else:
-                # do nothing if already blocked
-                pass
+            if not redis_client:
+                redis_client = await RedisClient()
+            if RateLimitService._check_script is None:
+                RateLimitService._check_script = redis_client.register_script(CHECK_LIMITS_SCRIPT)
+
+            blocked_index, count = await RateLimitService._check_script(
+                keys=redis_keys, args=args, client=redis_client
+            )
+            blocked_index, count = int(blocked_index), int(count)
         except Exception as e:
-            logger.error(f"Error caching rate limit decision in Redis: {str(e)}")
+            logger.error(f"Error checking rate limits in Redis: {str(e)}")
+            return None  # Allow if error to prevent false blocks
+
+        if not blocked_index:
+            return None
+
+        blocked = checks[blocked_index - 1]
+        record_data = blocked.get("record_data")
+
+        # Record the violation once per window, when the limit is first crossed
+        if count == blocked["max_requests"] + 1 and blocked.get("record_type") and record_data:
+            crud_rate_limit.queue_violation(
+                key=blocked["key"],
+                type=blocked["record_type"],
+                limit=blocked["max_requests"],
+                attempts=count,
+                ip=record_data.get("ip"),
+                user_id=record_data.get("user_id"),
+                endpoint=record_data.get("path"),
+            )
 
-        return is_allowed if is_allowed is not None else True
+        return blocked
 
     @staticmethod
-    async def warm_config_cache(
-        db_fetch_func,
-        **fetch_params
-    ) -> None:
+    async def is_limited(key: str, redis_client=None) -> Tuple[bool, Optional[str]]:
+        """
+        Check if a persistent rate limit is active for a key (e.g., "user:123")
+        """
+        if not redis_client:
+            redis_client = await RedisClient()
+        reason = await redis_client.get(
+            f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}limited:{key}"
+        )
+        if reason:
+            return True, reason
+        return False, None
+
+    @staticmethod
+    async def set_limited(
+        key: str,
+        reason: str,
+        duration_seconds: int,
+        redis_client=None,
+    ) -> bool:
         """
-        Initialize and warm up the rate limit configuration cache
+        Mark a key as rate limited for a period of time
         
         Args:
-            db_fetch_func: Function to call to fetch configurations
-            fetch_params: Additional parameters to pass to db_fetch_func
+            key: Limited identifier (e.g., "user:123" or "ip:192.168.1.1")
+            reason: Reason for the limit
+            duration_seconds: Time to keep the limit active
+            
+        Returns:
+            bool: Success status
         """
-        try:
-            # Fetch all configurations
-            configs = await db_fetch_func(**fetch_params)
-
-            if not configs:
-                logger.warning("No rate limit configurations found to cache")
-                return
-
+        if not redis_client:
             redis_client = await RedisClient()
+        await redis_client.set(
+            f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}limited:{key}",
+            reason,
+            ex=duration_seconds,
+        )
+        return True
 
-            # Cache each configuration
-            for config in configs:
-                try:
-                    if hasattr(config, "__dict__"):
-                        # Handle objects like RateLimitConfigResponse
-                        config_dict = config.__dict__
-                    elif not isinstance(config, dict):
-                        # Convert to dict if it's a model instance
-                        config_dict = serialize_mongo_doc(config)
-                    else:
-                        config_dict = config
-
-                    endpoint = config_dict.get("endpoint")
-                    if not endpoint:
-                        continue
-
-                    # Create Redis key
-                    redis_key = f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}config:{endpoint}"
-
-                    # Serialize and cache using the custom encoder to handle datetime objects
-                    config_json = json.dumps(config_dict, cls=MongoJSONEncoder)
-                    await redis_client.set(redis_key, config_json)
-                    await redis_client.expire(redis_key, settings.activity_RATE_LIMIT_CONFIG_TTL)
-                except Exception as e:
-                    logger.error(f"Error caching config for endpoint: {e}")
-                    continue
-
-            logger.info(f"Cached {len(configs)} rate limit configurations")
-
-        except Exception as e:
-            logger.error(f"Error warming rate limit config cache: {str(e)}")
+    @staticmethod
+    async def clear_limited(key: str) -> None:
+        """Remove a persistent rate limit for a key"""
+        redis_client = await RedisClient()
+        await redis_client.delete(f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}limited:{key}")
 
     @staticmethod
-    async def _record_analytics(
-        record_type,
-        record_data,
-        max_requests,
-        window_seconds
-    ) -> None:
-        """Record analytics and violations in ClickHouse"""
-        try:
-            # Use appropriate method based on record type
-            if record_type == "ip":
-                await crud_rate_limit.update_ip_request_count(
-                    ip=record_data.get("ip"),
-                    max_requests=max_requests,
-                    window_seconds=window_seconds
-                )
+    async def remove_user_limit(user_id: str) -> bool:
+        """
+        Lift a persistent user rate limit: the Redis flag enforced by the
+        middleware and the MongoDB record kept for admins
+        """
+        await RateLimitService.clear_limited(f"user:{user_id}")
+        return await crud_rate_limit.remove_user_rate_limit(user_id)
 
-            elif record_type == "user":
-                await crud_rate_limit.update_user_request_count(
-                    user_id=record_data.get("user_id"),
-                    path=record_data.get("path"),
-                    max_requests=max_requests,
-                    window_seconds=window_seconds
-                )
+    @staticmethod
+    def _compile_config_matcher(configs: List[Dict[str, Any]]):
+        """
+        Compile endpoint configurations into a single regex
+        
+        Exact endpoints are tried first, then "prefix*" endpoints from the
+        longest prefix down, so a match costs one pass over the path.
+        """
+        exact = [c for c in configs if c["endpoint"][-1:] != "*"]
+        prefixed = sorted(
+            (c for c in configs if c["endpoint"][-1:] == "*"),
+            key=lambda c: len(c["endpoint"]),
+            reverse=True,
+        )
+        ordered = exact + prefixed
+        if not ordered:
+            return None, []
+
+        alternatives = []
+        for i, config in enumerate(ordered):
+            endpoint = config["endpoint"]
+            if endpoint[-1:] == "*":
+                alternatives.append(f"(?P<c{i}>{re.escape(endpoint[:-1])})")
+            else:
+                alternatives.append(f"(?P<c{i}>{re.escape(endpoint)}\\Z)")
 
-            elif record_type == "endpoint":
-                await crud_rate_limit.update_endpoint_request_count(
-                    path=record_data.get("path"),
-                    client_ip=record_data.get("ip"),
-                    max_requests=max_requests,
-                    window_seconds=window_seconds
-                )
+        return re.compile("|".join(alternatives)), ordered
 
+    @staticmethod
+    async def load_config_matcher(db_fetch_func, **fetch_params) -> None:
+        """
+        Load all active endpoint configurations and compile the matcher
+        
+        Args:
+            db_fetch_func: Function to call to fetch configurations
+            fetch_params: Additional parameters to pass to db_fetch_func
+        """
+        try:
+            configs = await db_fetch_func(**fetch_params)
+            configs = [
+                config.model_dump() if hasattr(config, "model_dump") else dict(config)
+                for config in configs or []
+            ]
+            matcher, ordered = RateLimitService._compile_config_matcher(configs)
         except Exception as e:
-            logger.error(f"Error recording rate limit analytics: {e}")
+            logger.error(f"Error loading rate limit configurations: {str(e)}")
+            # Keep the previous matcher and back off instead of hitting
+            # the database on every request while it is failing
+            RateLimitService._config_matcher_expires_at = (
+                monotonic() + CONFIG_RELOAD_RETRY_SECONDS
+            )
+            return
+
+        RateLimitService._config_matcher = (matcher, ordered)
+        RateLimitService._config_matcher_expires_at = (
+            monotonic() + settings.activity_RATE_LIMIT_CONFIG_TTL
+        )
+        logger.info(f"Compiled {len(ordered)} rate limit configurations")
 
     @staticmethod
-    async def _check_limit(record_type, record_data, window_seconds) -> Optional[bool]:
-        """Record analytics and violations in ClickHouse"""
-        try:
-            # Use appropriate method based on record type
-            if record_type == "ip":
-                return await crud_rate_limit.check_ip_limit(
-                    ip=record_data.get("ip"),
-                    window_seconds=window_seconds
-                )
+    async def _refresh_config_matcher(db_fetch_func, **fetch_params) -> None:
+        """Reload the matcher once it expired, letting only one caller hit the database"""
+        if RateLimitService._config_matcher_expires_at > monotonic():
+            return
 
-            elif record_type == "user":
-                return await crud_rate_limit.check_user_limit(
-                    user_id=record_data.get("user_id"),
-                    path=record_data.get("path"),
-                    window_seconds=window_seconds,
-                )
+        if RateLimitService._config_matcher_lock is None:
+            RateLimitService._config_matcher_lock = asyncio.Lock()
 
-            elif record_type == "endpoint":
-                return await crud_rate_limit.check_endpoint_limit(
-                    path=record_data.get("path"),
-                    client_ip=record_data.get("ip"),
-                    window_seconds=window_seconds,
-                )
+        async with RateLimitService._config_matcher_lock:
+            # Another caller may have reloaded (or failed to) while we were waiting
+            if RateLimitService._config_matcher_expires_at <= monotonic():
+                await RateLimitService.load_config_matcher(db_fetch_func, **fetch_params)
 
-        except Exception as e:
-            logger.error(f"Error recording rate limit analytics: {e}")
+    @staticmethod
+    async def get_cached_configs(db_fetch_func, **fetch_params) -> List[Dict[str, Any]]:
+        """
+        Get all active endpoint configurations from the compiled matcher cache
+        
+        Args:
+            db_fetch_func: Function returning all active configurations
+            fetch_params: Parameters to pass to db_fetch_func
+            
+        Returns:
+            list: Endpoint configurations as dicts
+        """
+        await RateLimitService._refresh_config_matcher(db_fetch_func, **fetch_params)
+        if RateLimitService._config_matcher is None:
+            return []
 
-        return None
+        return RateLimitService._config_matcher[1]
 
     @staticmethod
     async def get_cached_config(
         endpoint: str,
         db_fetch_func,
         **fetch_params
-    ) -> Dict[str, Any]:
+    ) -> Optional[Dict[str, Any]]:
         """
-        Get cached endpoint configuration or fetch from database
+        Get the best matching endpoint configuration from the compiled matcher
+        
+        The matcher is rebuilt from the database every RATE_LIMIT_CONFIG_TTL
+        seconds, so the request path needs no network call at all.
         
         Args:
             endpoint: API endpoint path
-            db_fetch_func: Function to call if cache misses
+            db_fetch_func: Function returning all active configurations
             fetch_params: Parameters to pass to db_fetch_func
             
         Returns:
             dict: Endpoint configuration
         """
-        redis_client = await RedisClient()
-        redis_key = f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}config:{endpoint}"
+        await RateLimitService._refresh_config_matcher(db_fetch_func, **fetch_params)
+        if RateLimitService._config_matcher is None:
+            return None
 
-        # Try to get from cache
-        cached = await redis_client.get(redis_key)
-        if cached:
-            try:
-                # Parse the JSON string directly instead of using json module
-                return json.loads(cached)
-            except json.JSONDecodeError:
-                logger.warning(f"Invalid JSON in Redis cache for {endpoint}")
-
-        if "endpoint" not in fetch_params:
-            fetch_params["endpoint"] = endpoint
-
-        # Fetch from database
-        config = await db_fetch_func(**fetch_params)
-
-        # Cache the result
-        if config:
-            try:
-                # Use the utility function to make the config serializable
-                if hasattr(config, "__dict__"):
-                    # Handle objects like RateLimitConfigResponse
-                    serializable_config = config.__dict__
-                else:
-                    # Convert to dict if it's a model instance
-                    serializable_config = serialize_mongo_doc(config)
-
-                # Then serialize to JSON using the custom encoder
-                config_json = json.dumps(serializable_config, cls=MongoJSONEncoder)
-                await redis_client.set(redis_key, config_json)
-                await redis_client.expire(redis_key, settings.activity_RATE_LIMIT_CONFIG_TTL)
-            except Exception as e:
-                logger.error(f"Error caching config in Redis: {str(e)}")
-
-        return config
+        matcher, ordered = RateLimitService._config_matcher
+        match = matcher.match(endpoint) if matcher else None
+        if not match:
+            return None
+
+        return ordered[int(match.lastgroup[1:])]
+
+    @staticmethod
+    async def invalidate_config_cache() -> None:
+        """Drop the compiled configurations after they were changed"""
+        RateLimitService._config_matcher_expires_at = 0.0
 
     @staticmethod
     async def is_ip_blacklisted(
         ip: str,
         db_fetch_func=None,
+        redis_client=None,
         **fetch_params
     ) -> Tuple[bool, Optional[str]]:
         """
         Check if an IP is blacklisted, with Redis cache and violation records
         """
-        redis_client = await RedisClient()
+        if not redis_client:
+            redis_client = await RedisClient()
 
         # Check blacklist cache
         blacklist_key = f"{settings.activity_RATE_LIMIT_REDIS_PREFIX}blacklist:ip:{ip}"
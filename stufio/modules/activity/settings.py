@@ -132,15 +132,28 @@ settings_registry.register_setting(
 
 settings_registry.register_setting(
     SettingMetadata(
-        key="activity_RATE_LIMIT_DECISION_TTL",
-        label="Decision TTL",
-        description="The time-to-live for rate limit decisions",
+        key="activity_ACTIVITY_COUNT_LIMIT",
+        label="Activity Count Limit",
+        description="Maximum number of activities counted for paginated listings",
         group="activity",
-        subgroup="rate_limiting",
+        subgroup="activity",
+        type=SettingType.NUMBER,
+        order=100,
+        module="activity",
+    )
+)
+
+settings_registry.register_setting(
+    SettingMetadata(
+        key="activity_SECURITY_PROFILE_CACHE_TTL",
+        label="Security Profile Cache TTL",
+        description="How long a user's security profile is cached in memory",
+        group="activity",
+        subgroup="activity",
         type=SettingType.SLIDER,
-        order=80,
+        order=110,
         module="activity",
         min=0,
-        max=120,
+        max=3600,
     )
 )
@@ -0,0 +1,74 @@
+import pytest
+from unittest.mock import AsyncMock
+
+from stufio.modules.activity.consumers import api_request_consumer as consumer
+
+
+@pytest.fixture
+def check_suspicious(monkeypatch):
+    monkeypatch.setattr(consumer, "_clean_checks", consumer.OrderedDict())
+    mock = AsyncMock(return_value=False)
+    monkeypatch.setattr(consumer.crud_activity, "check_suspicious_activity", mock)
+    return mock
+
+
+async def _check(user_agent="test-agent", status_code=200):
+    return await consumer._check_suspicious_activity(
+        user_id="u1",
+        client_ip="1.2.3.4",
+        user_agent=user_agent,
+        path="/api/items",
+        method="GET",
+        status_code=status_code,
+    )
+
+
+@pytest.mark.asyncio
+async def test_clean_result_is_reused(check_suspicious):
+    assert await _check() is False
+    assert await _check(status_code=204) is False
+
+    check_suspicious.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_new_user_agent_is_checked(check_suspicious):
+    await _check()
+    await _check(user_agent="other-agent")
+
+    assert check_suspicious.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_expired_clean_result_is_checked_again(check_suspicious, monkeypatch):
+    monkeypatch.setattr(consumer, "CLEAN_CHECK_CACHE_TTL", -1)
+    await _check()
+    await _check()
+
+    assert check_suspicious.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_suspicious_result_is_not_cached(check_suspicious):
+    check_suspicious.return_value = True
+
+    assert await _check() is True
+    assert await _check() is True
+    assert check_suspicious.await_count == 2
+
+
+@pytest.mark.parametrize("path, ignored", [
+    ("/health", True),
+    ("/health/live", True),
+    ("/healthcare", False),
+    ("/static", True),
+    ("/static/app.js", True),
+    ("/statistics", False),
+    ("/api/items", False),
+])
+def test_ignored_paths_match_on_segment_boundaries(path, ignored, monkeypatch):
+    monkeypatch.setattr(
+        consumer.settings, "activity_ACTIVITY_IGNORED_PATH_PREFIXES", ["/health", "/static/"]
+    )
+
+    assert consumer._is_ignored_path(path) is ignored
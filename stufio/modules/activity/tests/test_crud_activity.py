@@ -0,0 +1,341 @@
+import asyncio
+import importlib
+import logging
+import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+from stufio.modules.activity.crud.crud_activity import CRUDUserActivity
+from stufio.modules.activity.models import ClientFingerprint, UserSecurityProfile
+
+# The crud package re-exports the instance under the module's name
+crud_activity_module = importlib.import_module("stufio.modules.activity.crud.crud_activity")
+
+
+class FakeClickhouse:
+    """Stand-in for CRUDClickhouse: the client is awaited on every use"""
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def client(self):
+        async def get_client():
+            return self._client
+        return get_client()
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    settings = crud_activity_module.settings
+    # Keep the background flushers asleep so tests flush explicitly
+    monkeypatch.setattr(settings, "activity_ACTIVITY_FLUSH_INTERVAL", 3600)
+    monkeypatch.setattr(settings, "activity_SECURITY_PROFILE_FLUSH_INTERVAL", 3600)
+    monkeypatch.setattr(settings, "activity_ACTIVITY_MAX_PENDING", 1000)
+    return settings
+
+
+@pytest.fixture
+def clickhouse():
+    client = MagicMock()
+    client.insert = AsyncMock()
+    client.query = AsyncMock()
+    return client
+
+
+@pytest.fixture
+def crud(settings, clickhouse):
+    crud = CRUDUserActivity()
+    crud.activity = FakeClickhouse(clickhouse)
+    yield crud
+    for task in (crud._flusher, crud._profile_flusher):
+        if task:
+            task.cancel()
+
+
+async def _create_activity(crud, user_id=None, path="/api/items"):
+    return await crud.create_activity(
+        user_id=user_id,
+        path=path,
+        method="GET",
+        client_ip="1.2.3.4",
+        user_agent="test-agent",
+        status_code=200,
+        process_time=0.01,
+        update_profile=False,
+    )
+
+
+def _inserted(clickhouse, table):
+    return [c.args[1] for c in clickhouse.insert.await_args_list if c.args[0] == table]
+
+
+@pytest.mark.asyncio
+async def test_activities_are_queued_and_flushed_in_one_insert(crud, clickhouse):
+    await _create_activity(crud, user_id="u1")
+    await _create_activity(crud)
+
+    clickhouse.insert.assert_not_called()
+    await crud.flush()
+
+    [rows] = _inserted(clickhouse, crud._activity_table)
+    assert [row[3] for row in rows] == ["u1", "anon-1.2.3.4"]
+    assert clickhouse.insert.await_args.kwargs["column_names"] == crud.ACTIVITY_COLUMNS
+    assert crud._activities == []
+
+
+@pytest.mark.asyncio
+async def test_flush_sends_one_batch_per_table(crud, clickhouse):
+    for _ in range(5):
+        await _create_activity(crud)
+
+    assert await crud.flush(batch_size=2)
+
+    assert [len(rows) for rows in _inserted(clickhouse, crud._activity_table)] == [2]
+    assert len(crud._activities) == 3
+
+
+@pytest.mark.asyncio
+async def test_activities_past_max_pending_are_dropped(crud, clickhouse, settings, monkeypatch, caplog):
+    monkeypatch.setattr(settings, "activity_ACTIVITY_MAX_PENDING", 2)
+    for _ in range(3):
+        assert await _create_activity(crud)
+
+    assert len(crud._activities) == 2
+    assert crud._dropped_activities == 1
+
+    with caplog.at_level(logging.WARNING):
+        await crud.flush()
+
+    assert "Dropped 1 activities" in caplog.text
+    assert crud._dropped_activities == 0
+    [rows] = _inserted(clickhouse, crud._activity_table)
+    assert len(rows) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_requeued(crud, clickhouse, caplog):
+    await _create_activity(crud, user_id="u1")
+    await _create_activity(crud, user_id="u2")
+    clickhouse.insert.side_effect = RuntimeError("clickhouse down")
+
+    assert not await crud.flush(batch_size=1)
+
+    assert "Failed to flush 1 rows" in caplog.text
+    assert [row[3] for row in crud._activities] == ["u1", "u2"]
+
+    clickhouse.insert.side_effect = None
+    assert await crud.flush()
+    [_, rows] = _inserted(clickhouse, crud._activity_table)
+    assert [row[3] for row in rows] == ["u1", "u2"]
+
+
+@pytest.mark.asyncio
+async def test_requeue_stays_within_max_pending(crud, clickhouse, settings, monkeypatch):
+    monkeypatch.setattr(settings, "activity_ACTIVITY_MAX_PENDING", 2)
+    await _create_activity(crud)
+    await _create_activity(crud)
+
+    async def insert_while_failing(*args, **kwargs):
+        # New rows arrive while the failing insert is in flight
+        await _create_activity(crud)
+        raise RuntimeError("clickhouse down")
+
+    clickhouse.insert.side_effect = insert_while_failing
+    await crud.flush()
+
+    assert len(crud._activities) == 2
+    assert crud._dropped_activities == 1
+
+
+@pytest.mark.asyncio
+async def test_suspicious_activity_is_queued_with_severity(crud, clickhouse):
+    await crud.create_suspicious_activity_log(
+        user_id=None,
+        client_ip="1.2.3.4",
+        user_agent="test-agent",
+        reason="Repeated login failures",
+        path="/api/login",
+        method="POST",
+        status_code=401,
+    )
+
+    await crud.flush()
+
+    [[row]] = _inserted(clickhouse, crud._suspicious_table)
+    columns = dict(zip(crud.SUSPICIOUS_COLUMNS, row))
+    assert columns["user_id"] == "1.2.3.4#test-agent"
+    assert columns["severity"] == "high"
+
+
+@pytest.fixture
+def profiles_collection(crud):
+    collection = MagicMock()
+    collection.bulk_write = AsyncMock()
+    collection.update_one = AsyncMock()
+    crud.security_profiles = MagicMock()
+    crud.security_profiles.engine.get_collection = AsyncMock(return_value=collection)
+    crud._cache_profile(UserSecurityProfile(
+        user_id="u1",
+        known_fingerprints=[ClientFingerprint(ip="1.2.3.4", user_agent="test-agent")],
+    ))
+    return collection
+
+
+@pytest.mark.asyncio
+async def test_known_fingerprint_hits_are_coalesced(crud, profiles_collection):
+    for _ in range(3):
+        await crud.update_user_security_profile("u1", "1.2.3.4", "test-agent")
+
+    profiles_collection.bulk_write.assert_not_called()
+    await crud.flush_fingerprint_hits()
+
+    [requests] = profiles_collection.bulk_write.await_args.args
+    assert len(requests) == 1
+    assert requests[0]._doc["$inc"] == {"known_fingerprints.$.request_count": 3}
+    assert crud._fingerprint_hits == {}
+
+    # Nothing left to write
+    await crud.flush_fingerprint_hits()
+    profiles_collection.bulk_write.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_new_fingerprint_is_pushed_once(crud, profiles_collection):
+    await crud.update_user_security_profile("u1", "5.6.7.8", "other-agent")
+
+    profiles_collection.update_one.assert_awaited_once()
+    query, update = profiles_collection.update_one.await_args.args
+    assert query["known_fingerprints"]["$not"]["$elemMatch"] == {
+        "ip": "5.6.7.8", "user_agent": "other-agent"
+    }
+    assert update["$push"]["known_fingerprints"]["ip"] == "5.6.7.8"
+    assert crud._fingerprint_hits == {}
+
+
+@pytest.mark.asyncio
+async def test_fingerprint_index_is_kept_with_the_cached_profile(crud, profiles_collection, monkeypatch):
+    build_index = MagicMock(side_effect=crud_activity_module._fingerprint_index)
+    monkeypatch.setattr(crud_activity_module, "_fingerprint_index", build_index)
+
+    await crud.update_user_security_profile("u1", "5.6.7.8", "other-agent")
+    await crud.update_user_security_profile("u1", "5.6.7.8", "other-agent")
+    await crud.update_user_security_profile("u1", "1.2.3.4", "test-agent")
+
+    # The pushed fingerprint went into the cached index, which is never rebuilt
+    build_index.assert_not_called()
+    profiles_collection.update_one.assert_awaited_once()
+    assert set(crud._fingerprint_hits) == {
+        ("u1", "5.6.7.8", "other-agent"), ("u1", "1.2.3.4", "test-agent")
+    }
+
+    crud._invalidate_profile("u1")
+    assert "u1" not in crud._profiles
+
+
+@pytest.mark.asyncio
+async def test_clickhouse_ip_count_runs_only_for_unknown_devices(crud, clickhouse, profiles_collection, monkeypatch):
+    # Redis is down
+    monkeypatch.setattr(crud_activity_module, "RedisClient", AsyncMock(side_effect=ConnectionError("down")))
+    result = MagicMock()
+    result.result_rows = [[1]]
+    clickhouse.query.return_value = result
+
+    async def check(client_ip, user_agent):
+        return await crud.check_suspicious_activity(
+            user_id="u1",
+            client_ip=client_ip,
+            user_agent=user_agent,
+            path="/api/items",
+            method="GET",
+            status_code=200,
+        )
+
+    assert await check("1.2.3.4", "test-agent") is False
+    clickhouse.query.assert_not_called()
+
+    assert await check("9.9.9.9", "other-agent") is False
+    clickhouse.query.assert_awaited_once()
+
+
+class SingleSessionClient:
+    """Query client that, like a client with a session id, rejects overlapping queries"""
+
+    def __init__(self, result):
+        self.result = result
+        self.queries = []
+        self._running = False
+
+    async def query(self, query, parameters=None):
+        if self._running:
+            raise RuntimeError("Attempt to execute concurrent queries within the same session")
+        self._running = True
+        try:
+            await asyncio.sleep(0)
+            self.queries.append((query, parameters))
+            return self.result
+        finally:
+            self._running = False
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_runs_one_query_at_a_time(crud):
+    result = MagicMock()
+    result.result_rows = [[3]]
+    result.named_results.return_value = []
+    client = SingleSessionClient(result)
+    crud.activity = FakeClickhouse(client)
+
+    activities, total = await crud.get_user_activities(user_id="u1")
+
+    assert (activities, total) == ([], 3)
+    assert len(client.queries) == 2
+
+
+@pytest.mark.asyncio
+async def test_suspicious_analytics_runs_one_query_at_a_time(crud):
+    result = MagicMock()
+    result.first_row_as_dict.return_value = {"total_activities": 1}
+    result.named_results.return_value = []
+    client = SingleSessionClient(result)
+    crud.suspicious = FakeClickhouse(client)
+
+    analytics = await crud.get_suspicious_activity_analytics(days=7)
+
+    assert "error" not in analytics
+    assert analytics["summary"] == {"total_activities": 1}
+    assert len(client.queries) == 4
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_pages_by_key(crud, clickhouse):
+    result = MagicMock()
+    result.result_rows = [[250]]
+    result.named_results.return_value = []
+    clickhouse.query.return_value = result
+    before = datetime(2026, 10, 15, 12, 0, 0)
+
+    activities, total = await crud.get_user_activities(
+        user_id="u1", skip=40, limit=20, before=before, before_id="event-1"
+    )
+
+    assert (activities, total) == ([], 250)
+    page_query = clickhouse.query.await_args_list[1]
+    assert "(timestamp, event_id) <" in page_query.args[0]
+    assert page_query.kwargs["parameters"] == {
+        "user_id": "u1", "limit": 20, "skip": 0, "before": before, "before_id": "event-1"
+    }
+
+
+@pytest.mark.asyncio
+async def test_get_user_activities_pages_by_offset_without_cursor(crud, clickhouse):
+    result = MagicMock()
+    result.result_rows = [[0]]
+    result.named_results.return_value = []
+    clickhouse.query.return_value = result
+
+    await crud.get_user_activities(user_id="u1", skip=40, limit=20)
+
+    page_query = clickhouse.query.await_args_list[1]
+    assert "event_id) <" not in page_query.args[0]
+    assert page_query.kwargs["parameters"] == {"user_id": "u1", "limit": 20, "skip": 40}
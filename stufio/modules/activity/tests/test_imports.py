@@ -0,0 +1,11 @@
+def test_module_imports():
+    from stufio.modules.activity import ActivityModule
+    from stufio.modules.activity.crud import crud_activity, crud_rate_limit
+    from stufio.modules.activity.models import SuspiciousActivity, UserActivity
+    from stufio.modules.activity.services.rate_limit import rate_limit_service
+
+    assert ActivityModule.version
+    assert crud_activity._activity_table == UserActivity.get_table_name()
+    assert crud_activity._suspicious_table == SuspiciousActivity.get_table_name()
+    assert crud_rate_limit._violations == []
+    assert rate_limit_service is not None
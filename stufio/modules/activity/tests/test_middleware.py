@@ -0,0 +1,40 @@
+import time
+import pytest
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from stufio.modules.activity.middleware import rate_limiter
+
+
+@pytest.fixture
+def get_token_payload(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_token_cache", rate_limiter.OrderedDict())
+    mock = MagicMock(return_value=SimpleNamespace(sub="u1", exp=time.time() + 3600))
+    monkeypatch.setattr(rate_limiter.deps, "get_token_payload", mock)
+    return mock
+
+
+def test_token_subject_is_cached(get_token_payload):
+    assert rate_limiter._get_token_subject("token") == "u1"
+    assert rate_limiter._get_token_subject("token") == "u1"
+
+    get_token_payload.assert_called_once_with("token")
+
+
+def test_token_cache_expires_with_the_token(get_token_payload):
+    get_token_payload.return_value = SimpleNamespace(sub="u1", exp=time.time() - 1)
+
+    rate_limiter._get_token_subject("token")
+    rate_limiter._get_token_subject("token")
+
+    assert get_token_payload.call_count == 2
+
+
+def test_token_cache_is_bounded(get_token_payload, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "TOKEN_CACHE_SIZE", 2)
+    for token in ("a", "b", "c"):
+        rate_limiter._get_token_subject(token)
+
+    assert len(rate_limiter._token_cache) == 2
+    rate_limiter._get_token_subject("a")
+    assert get_token_payload.call_count == 4
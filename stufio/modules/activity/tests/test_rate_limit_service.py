@@ -0,0 +1,203 @@
+import pytest
+from datetime import datetime, timezone
+from time import monotonic
+from bson import ObjectId
+from unittest.mock import AsyncMock, MagicMock
+
+from stufio.modules.activity.services import rate_limit
+from stufio.modules.activity.services.rate_limit import RateLimitService
+
+
+@pytest.fixture(autouse=True)
+def reset_service(monkeypatch):
+    """Start every test without a registered script or compiled matcher"""
+    monkeypatch.setattr(RateLimitService, "_check_script", None)
+    monkeypatch.setattr(RateLimitService, "_config_matcher", None)
+    monkeypatch.setattr(RateLimitService, "_config_matcher_expires_at", 0.0)
+    monkeypatch.setattr(RateLimitService, "_config_matcher_lock", None)
+
+
+@pytest.fixture
+def queue_violation(monkeypatch):
+    mock = MagicMock()
+    monkeypatch.setattr(rate_limit.crud_rate_limit, "queue_violation", mock)
+    return mock
+
+
+@pytest.fixture
+def redis():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Lua support for fakeredis
+    return fakeredis.aioredis.FakeRedis()
+
+
+def _checks():
+    return [
+        {"key": "ip:1.2.3.4", "max_requests": 5, "window_seconds": 60,
+         "record_type": "ip", "record_data": {"ip": "1.2.3.4"}},
+        {"key": "user:u1", "max_requests": 1, "window_seconds": 60,
+         "record_type": "user", "record_data": {"user_id": "u1"}},
+        {"key": "user:u1:/api/items", "max_requests": 5, "window_seconds": 60,
+         "record_type": "endpoint", "record_data": {"path": "/api/items"}},
+    ]
+
+
+async def _counters(redis, checks):
+    prefix = rate_limit.settings.activity_RATE_LIMIT_REDIS_PREFIX + "{check}:"
+    values = [await redis.get(prefix + check["key"]) for check in checks]
+    return [int(value) if value is not None else 0 for value in values]
+
+
+@pytest.mark.asyncio
+async def test_check_limits_allows_and_counts_every_key(redis, queue_violation):
+    checks = _checks()
+
+    assert await RateLimitService.check_limits(checks, redis_client=redis) is None
+    assert await _counters(redis, checks) == [1, 1, 1]
+    queue_violation.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_check_limits_stops_at_first_exceeded_key(redis, queue_violation):
+    checks = _checks()
+    await RateLimitService.check_limits(checks, redis_client=redis)
+
+    blocked = await RateLimitService.check_limits(checks, redis_client=redis)
+
+    assert blocked is checks[1]
+    # Keys after the exceeded one are not incremented
+    assert await _counters(redis, checks) == [2, 2, 1]
+    queue_violation.assert_called_once()
+    assert queue_violation.call_args.kwargs["attempts"] == 2
+
+
+@pytest.mark.asyncio
+async def test_check_limits_records_violation_once_per_window(redis, queue_violation):
+    checks = _checks()
+    for _ in range(4):
+        await RateLimitService.check_limits(checks, redis_client=redis)
+
+    queue_violation.assert_called_once()
+
+
+def test_check_keys_share_one_cluster_slot():
+    # Redis Cluster hashes only the part between the first { and }
+    prefix = f"{rate_limit.settings.activity_RATE_LIMIT_REDIS_PREFIX}{rate_limit.CHECK_KEY_HASH_TAG}:"
+    tags = {
+        (prefix + check["key"]).split("{", 1)[1].split("}", 1)[0]
+        for check in _checks()
+    }
+    assert tags == {"check"}
+
+
+@pytest.mark.asyncio
+async def test_check_limits_allows_when_redis_fails(queue_violation):
+    redis = MagicMock()
+    redis.register_script.return_value = AsyncMock(side_effect=ConnectionError("down"))
+
+    assert await RateLimitService.check_limits(_checks(), redis_client=redis) is None
+    queue_violation.assert_not_called()
+
+
+CONFIGS = [
+    {"endpoint": "/api/*", "max_requests": 100, "window_seconds": 60},
+    {"endpoint": "/api/items/*", "max_requests": 10, "window_seconds": 60},
+    {"endpoint": "/api/items", "max_requests": 1, "window_seconds": 60},
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("path, endpoint", [
+    ("/api/items", "/api/items"),
+    ("/api/items/42", "/api/items/*"),
+    ("/api/other", "/api/*"),
+    ("/api/items2", "/api/*"),
+    ("/other", None),
+])
+async def test_get_cached_config_prefers_exact_then_longest_prefix(path, endpoint):
+    fetch = AsyncMock(return_value=CONFIGS)
+
+    config = await RateLimitService.get_cached_config(path, db_fetch_func=fetch)
+
+    assert (config["endpoint"] if config else None) == endpoint
+
+
+@pytest.mark.asyncio
+async def test_config_matcher_is_reused_until_invalidated():
+    fetch = AsyncMock(return_value=CONFIGS)
+
+    await RateLimitService.get_cached_config("/api/items", db_fetch_func=fetch)
+    await RateLimitService.get_cached_configs(db_fetch_func=fetch)
+    assert fetch.await_count == 1
+
+    await RateLimitService.invalidate_config_cache()
+    await RateLimitService.get_cached_config("/api/items", db_fetch_func=fetch)
+    assert fetch.await_count == 2
+
+
+@pytest.fixture
+def config_collection(monkeypatch):
+    """Back crud_rate_limit.fetch_rate_limit_configs with a mocked MongoDB cursor"""
+    collection = MagicMock()
+    cursor = collection.find.return_value.sort.return_value.skip.return_value.limit.return_value
+    cursor.to_list = AsyncMock()
+    config = MagicMock()
+    config.engine.get_collection.return_value = collection
+    monkeypatch.setattr(rate_limit.crud_rate_limit, "config", config)
+    return cursor
+
+
+def _documents():
+    now = datetime.now(timezone.utc)
+    return [
+        {"_id": ObjectId(), "created_at": now, "updated_at": now, "active": True, **config}
+        for config in CONFIGS
+    ]
+
+
+async def _get_config(path):
+    return await RateLimitService.get_cached_config(
+        path,
+        db_fetch_func=rate_limit.crud_rate_limit.fetch_rate_limit_configs,
+        active_only=True,
+        limit=1000,
+    )
+
+
+@pytest.mark.asyncio
+async def test_failed_config_reload_backs_off(config_collection):
+    config_collection.to_list.side_effect = RuntimeError("mongo down")
+
+    assert await _get_config("/api/items") is None
+    assert await _get_config("/api/items") is None
+
+    assert config_collection.to_list.await_count == 1
+    assert RateLimitService._config_matcher_expires_at > monotonic()
+
+
+@pytest.mark.asyncio
+async def test_failed_config_reload_keeps_previous_matcher(config_collection):
+    config_collection.to_list.return_value = _documents()
+    assert (await _get_config("/api/items"))["max_requests"] == 1
+
+    await RateLimitService.invalidate_config_cache()
+    config_collection.to_list.side_effect = RuntimeError("mongo down")
+
+    # Limits stay enforced with the last configurations that loaded
+    assert (await _get_config("/api/items"))["max_requests"] == 1
+    assert config_collection.to_list.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_remove_user_limit_clears_the_redis_flag(monkeypatch):
+    redis = AsyncMock()
+    monkeypatch.setattr(rate_limit, "RedisClient", AsyncMock(return_value=redis))
+    remove = AsyncMock(return_value=True)
+    monkeypatch.setattr(rate_limit.crud_rate_limit, "remove_user_rate_limit", remove)
+
+    assert await RateLimitService.remove_user_limit("u1")
+
+    redis.delete.assert_awaited_once_with(
+        f"{rate_limit.settings.activity_RATE_LIMIT_REDIS_PREFIX}limited:user:u1"
+    )
+    remove.assert_awaited_once_with("u1")